@@ -0,0 +1,212 @@
+""" Compare the throughput of the Flask app and the ASGI app.
+
+Both apps are driven in-process against the same SQLite corpus: the
+Flask app from a pool of threads, as a threaded WSGI server would, and
+the ASGI app from concurrent tasks on one event loop. Each scenario runs
+at every concurrency level given:
+
+    python benchmarks/async_compare.py --questions 100000 \\
+        --concurrency 8,64,512 --output async.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import WORDS, git_commit, percentile, seed  # noqa: E402
+from flaskr import create_app  # noqa: E402
+from flaskr.asgi import TriviaASGI  # noqa: E402
+from models import setup_db  # noqa: E402
+
+
+def scenarios(args):
+    """ Map each scenario name to a function returning (method, path,
+        body) for one request.
+    """
+    pages = max(1, args.questions // 10)
+
+    def list_questions(rng):
+        return 'GET', '/questions?page={}'.format(rng.randint(1, pages)), None
+
+    def list_category(rng):
+        return 'GET', '/categories/{}/questions?page={}'.format(
+            rng.randint(1, args.categories),
+            rng.randint(1, max(1, pages // args.categories))), None
+
+    def search(rng):
+        return 'POST', '/questions', {'searchTerm': rng.choice(WORDS)}
+
+    def quiz(rng):
+        return 'POST', '/quizzes', {
+            'previous_questions': [
+                rng.randint(1, args.questions) for _ in range(rng.randint(0, 20))
+            ],
+            'quiz_category': {'id': rng.randint(0, args.categories)}
+        }
+
+    return {
+        'list_questions': list_questions,
+        'list_category': list_category,
+        'search': search,
+        'quiz': quiz
+    }
+
+
+def summarize(latencies, errors, wall_time):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / wall_time, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3)
+    }
+
+
+def run_sync(app, make_request, concurrency, args):
+    """ args.requests requests over `concurrency` threads. """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = max(1, args.requests // concurrency)
+
+    def worker(worker_index):
+        client = app.test_client()
+        rng = random.Random(args.seed + worker_index)
+        for _ in range(per_thread):
+            method, path, body = make_request(rng)
+            start = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code >= 500:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+async def run_async(app, make_request, concurrency, args):
+    """ args.requests requests over `concurrency` tasks. """
+    latencies = []
+    errors = [0]
+    per_task = max(1, args.requests // concurrency)
+
+    async def request(method, path, body):
+        path, _, query = path.partition('?')
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        statuses = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': data}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        await app({
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query.encode('ascii')
+        }, receive, send)
+        return statuses[0]
+
+    async def worker(worker_index):
+        rng = random.Random(args.seed + worker_index)
+        for _ in range(per_task):
+            start = time.perf_counter()
+            status = await request(*make_request(rng))
+            latencies.append(time.perf_counter() - start)
+            if status >= 500:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(index) for index in range(concurrency)))
+
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default='sqlite:///bench.db',
+                        help='SQLite URL. Its tables are dropped and '
+                             'recreated unless --skip-seed.')
+    parser.add_argument('--questions', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=6)
+    parser.add_argument('--concurrency', default='8,64,256',
+                        help='Comma separated concurrency levels.')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='Requests per scenario and concurrency level.')
+    parser.add_argument('--scenarios', default=None,
+                        help='Comma separated subset of scenarios to run.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-seed', action='store_true')
+    parser.add_argument('--output', default=None,
+                        help='Write the results to this JSON file.')
+    return parser.parse_args()
+
+
+async def compare(args, sync_app, requests, names, levels):
+    async_app = TriviaASGI(args.database_url, sync_app)
+    results = {}
+    try:
+        for name in names:
+            for concurrency in levels:
+                key = '{}@{}'.format(name, concurrency)
+                results[key] = {
+                    'sync': run_sync(
+                        sync_app, requests[name], concurrency, args),
+                    'async': await run_async(
+                        async_app, requests[name], concurrency, args)
+                }
+                print('{:<22} sync {:>9.2f} rps   async {:>9.2f} rps'.format(
+                    key, results[key]['sync']['throughput_rps'],
+                    results[key]['async']['throughput_rps']))
+    finally:
+        await async_app.shutdown()
+    return results
+
+
+def main():
+    args = parse_args()
+    sync_app = create_app({'SEARCH_BACKEND': 'sql'})
+    setup_db(sync_app, args.database_url)
+
+    if not args.skip_seed:
+        seed(sync_app, args.questions, args.categories,
+             random.Random(args.seed))
+
+    requests = scenarios(args)
+    names = args.scenarios.split(',') if args.scenarios else list(requests)
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    results = asyncio.run(compare(args, sync_app, requests, names, levels))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'commit': git_commit(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'config': {
+                    'questions': args.questions,
+                    'categories': args.categories,
+                    'requests': args.requests
+                },
+                'scenarios': results
+            }, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+""" Load-test every trivia API route against a synthetic question bank.
+
+Seeds a corpus of configurable size into SQLite or PostgreSQL, drives each
+route at a fixed concurrency and reports latency percentiles, throughput
+and SQL queries per request. Results are written as JSON so runs on
+different commits can be compared:
+
+    python benchmarks/bench.py --questions 100000 --output before.json
+    git checkout my-branch
+    python benchmarks/bench.py --skip-seed --compare before.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskr import create_app  # noqa: E402
+from flaskr.transfer import copy_rows  # noqa: E402
+from models import setup_db, db, Category  # noqa: E402
+
+SEED_BATCH_SIZE = 10000
+WORDS = (
+    'world river planet painter author ocean capital battle empire movie '
+    'team element island composer mountain king queen museum novel league'
+).split()
+
+# ----------------------------------------------------------------------------#
+# Corpus
+# ----------------------------------------------------------------------------#
+
+
+def seed(app, questions, categories, rng):
+    """ Recreate the tables and fill them with a synthetic corpus. """
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all(
+            Category('Category {}'.format(index))
+            for index in range(1, categories + 1)
+        )
+        db.session.commit()
+
+        for start in range(0, questions, SEED_BATCH_SIZE):
+            rows = [{
+                'question': 'Question {} about the {} and the {}?'.format(
+                    index, rng.choice(WORDS), rng.choice(WORDS)),
+                'answer': 'Answer {}'.format(index),
+                'category': rng.randint(1, categories),
+                'difficulty': rng.randint(1, 5)
+            } for index in range(start, min(start + SEED_BATCH_SIZE,
+                                            questions))]
+            copy_rows(rows)
+            db.session.commit()
+
+# ----------------------------------------------------------------------------#
+# Scenarios
+# ----------------------------------------------------------------------------#
+
+
+def scenarios(args):
+    """ Map each scenario name to a function issuing one request. """
+    created_ids = []
+    created_lock = threading.Lock()
+    pages = max(1, args.questions // 10)
+
+    def list_questions(client, rng):
+        return client.get('/questions?page={}'.format(rng.randint(1, pages)))
+
+    def list_category(client, rng):
+        return client.get('/categories/{}/questions?page={}'.format(
+            rng.randint(1, args.categories),
+            rng.randint(1, max(1, pages // args.categories))))
+
+    def list_categories(client, rng):
+        return client.get('/categories')
+
+    def search(client, rng):
+        return client.post('/questions', json={'searchTerm': rng.choice(WORDS)})
+
+    def quiz(client, rng):
+        return client.post('/quizzes', json={
+            'previous_questions': [
+                rng.randint(1, args.questions) for _ in range(rng.randint(0, 20))
+            ],
+            'quiz_category': {'id': rng.randint(0, args.categories)}
+        })
+
+    def create(client, rng):
+        # random word sequences, so the questions are not duplicates
+        return client.post('/questions', json={
+            'question': 'Benchmark question about the {}?'.format(
+                ' '.join(rng.sample(WORDS, 6))),
+            'answer': 'Benchmark answer',
+            'category': rng.randint(1, args.categories),
+            'difficulty': rng.randint(1, 5)
+        })
+
+    def delete(client, rng):
+        with created_lock:
+            question_id = created_ids.pop() if created_ids else None
+        if question_id is None:
+            question_id = rng.randint(1, args.questions)
+        return client.delete('/questions/{}'.format(question_id))
+
+    def collect_created(app):
+        with app.app_context():
+            rows = db.session.execute(
+                "SELECT id FROM questions WHERE answer = 'Benchmark answer'"
+            ).fetchall()
+        created_ids.extend(row[0] for row in rows)
+
+    return {
+        'list_questions': list_questions,
+        'list_category': list_category,
+        'list_categories': list_categories,
+        'search': search,
+        'quiz': quiz,
+        'create': create,
+        'delete': delete
+    }, collect_created
+
+
+def sql_queries(response):
+    """ Read the query count from the Server-Timing header. """
+    timing = response.headers.get('Server-Timing', '')
+    for metric in timing.split(','):
+        if metric.strip().startswith('db;'):
+            description = metric.split('desc="', 1)[1].split('"', 1)[0]
+            return int(description.split()[0])
+    return 0
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_scenario(app, request, args):
+    """ Issue args.requests requests over args.concurrency threads. """
+    latencies = []
+    queries = []
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = max(1, args.requests // args.concurrency)
+
+    def worker(worker_index):
+        client = app.test_client()
+        rng = random.Random(args.seed + worker_index)
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            response = request(client, rng)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                queries.append(sql_queries(response))
+                if response.status_code >= 500:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(worker, range(args.concurrency)))
+    wall_time = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / wall_time, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'sql_queries_per_request': round(sum(queries) / len(queries), 2)
+    }
+
+# ----------------------------------------------------------------------------#
+# Reporting
+# ----------------------------------------------------------------------------#
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """ Print the latency and throughput change against a previous run. """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    print('\nCompared with {} ({}):'.format(
+        baseline_path, baseline.get('commit')))
+    for name, current in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if previous is None:
+            continue
+        print('  {:<16} p95 {:>9.3f} -> {:>9.3f} ms   '
+              'throughput {:>9.2f} -> {:>9.2f} rps'.format(
+                  name, previous['p95_ms'], current['p95_ms'],
+                  previous['throughput_rps'], current['throughput_rps']))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default='sqlite:///bench.db',
+                        help='SQLite or PostgreSQL URL. Its tables are '
+                             'dropped and recreated unless --skip-seed.')
+    parser.add_argument('--questions', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=6)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=800,
+                        help='Requests per scenario.')
+    parser.add_argument('--scenarios', default=None,
+                        help='Comma separated subset of scenarios to run.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed for the corpus and the requests.')
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='Reuse the corpus already in the database.')
+    parser.add_argument('--output', default=None,
+                        help='Write the results to this JSON file.')
+    parser.add_argument('--compare', default=None,
+                        help='Results JSON of a previous run to compare to.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    app = create_app({'METRICS_ENABLED': True})
+    setup_db(app, args.database_url)
+
+    if not args.skip_seed:
+        started = time.perf_counter()
+        seed(app, args.questions, args.categories, random.Random(args.seed))
+        print('Seeded {} questions in {:.1f}s'.format(
+            args.questions, time.perf_counter() - started))
+
+    requests, collect_created = scenarios(args)
+    names = args.scenarios.split(',') if args.scenarios else list(requests)
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'database': args.database_url.split(':', 1)[0],
+            'questions': args.questions,
+            'categories': args.categories,
+            'concurrency': args.concurrency,
+            'requests': args.requests
+        },
+        'scenarios': {}
+    }
+    for name in names:
+        if name == 'delete':
+            collect_created(app)
+        results['scenarios'][name] = run_scenario(app, requests[name], args)
+        print('{:<16} {}'.format(name, results['scenarios'][name]))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
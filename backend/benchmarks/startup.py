@@ -0,0 +1,109 @@
+""" Measure how long a fresh worker takes to become ready.
+
+Each run starts a new interpreter and times importing the app, create_app
+and the first requests, the way a prefork worker or a serverless instance
+pays for them after a cold start. Point it at a seeded database (see
+bench.py) and compare the startup modes:
+
+    python benchmarks/startup.py --database-url sqlite:///bench.db
+    python benchmarks/startup.py --lean --warm-up --output lean.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_REQUESTS = ('/categories', '/questions', '/categories/1/questions')
+
+# runs in the child interpreter, prints its timings as JSON
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+from flaskr import create_app, warm_up
+from models import setup_db
+imported = time.perf_counter()
+lean, warm, database_url, paths = json.loads(sys.argv[1])
+app = create_app({'LEAN_STARTUP': lean, 'WARM_UP': False})
+setup_db(app, database_url, migrations=not lean)
+if warm:
+    warm_up(app)
+created = time.perf_counter()
+client = app.test_client()
+first_requests = []
+for path in paths:
+    request_started = time.perf_counter()
+    client.get(path)
+    first_requests.append(time.perf_counter() - request_started)
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_requests_ms': [elapsed * 1000 for elapsed in first_requests]
+}))
+'''
+
+
+def run_once(args):
+    """ Time one cold start in a new interpreter. """
+    started = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD, json.dumps([
+            args.lean, args.warm_up, args.database_url, FIRST_REQUESTS
+        ])],
+        cwd=BACKEND
+    )
+    timings = json.loads(output.decode().strip().splitlines()[-1])
+    timings['process_ms'] = (time.perf_counter() - started) * 1000
+    return timings
+
+
+def summarize(runs):
+    """ Median of every timing over the runs. """
+    summary = {
+        name: round(statistics.median(run[name] for run in runs), 3)
+        for name in ('import_ms', 'create_app_ms', 'process_ms')
+    }
+    for index, path in enumerate(FIRST_REQUESTS):
+        summary['first_request_ms ' + path] = round(statistics.median(
+            run['first_requests_ms'][index] for run in runs), 3)
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default='sqlite:///bench.db',
+                        help='A database already seeded by bench.py.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--lean', action='store_true',
+                        help='Start with LEAN_STARTUP.')
+    parser.add_argument('--warm-up', action='store_true',
+                        help='Start with WARM_UP.')
+    parser.add_argument('--output', default=None,
+                        help='Write the results to this JSON file.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    summary = summarize([run_once(args) for _ in range(args.runs)])
+    for name, value in summary.items():
+        print('{:<40} {:>9.3f} ms'.format(name, value))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'config': {
+                    'database': args.database_url.split(':', 1)[0],
+                    'runs': args.runs,
+                    'lean': args.lean,
+                    'warm_up': args.warm_up
+                },
+                'startup': summary
+            }, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
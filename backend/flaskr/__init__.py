@@ -1,13 +1,56 @@
+import base64
+import bisect
+import hashlib
 import json
 import os
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+import queue
+import click
+from flask import (
+    Flask, Response, current_app, request, abort, jsonify,
+    stream_with_context
+)
 from flask_cors import CORS
-import random
 
-from models import setup_db, Question, Category
+from models import (
+    setup_db, db, use_read_replica, Question, question_counts
+)
+from .answers import answer_index, answer_matches, normalize_answer
+from .cache import category_cache, generations, response_cache
+from .compression import COMPRESS_MIN_SIZE, compress_response
+from .duplicates import (
+    DUPLICATE_SIMILARITY, duplicate_groups, duplicate_index
+)
+from .fragments import (
+    QUESTION_COLUMNS, QUESTION_FIELDS, json_fragment, json_page,
+    load_fragments, narrow_fragments
+)
+from .scores import leaderboard, validate_score
+from .metrics import METRICS_ENABLED, init_metrics
+from .quiz import (
+    adaptive_target, decode_quiz_state, draw_question, encode_quiz_state,
+    quiz_pools
+)
+from .search import get_search_backend
+from .snapshot import SNAPSHOT_PATH, SnapshotStore, write_snapshot
+from .transfer import (
+    MAX_BATCH_SIZE, create_questions, delete_questions, export_questions,
+    import_questions, iter_csv, iter_ndjson, validate_question
+)
+from .writes import ASYNC_QUESTION_WRITES, question_writes
 
 QUESTIONS_PER_PAGE = 10
+# signs quiz state tokens, which are disabled without it; every worker
+# must share it to accept the others' tokens
+SECRET_KEY = os.getenv('SECRET_KEY', None)
+# skip loading the migration tooling in web workers
+LEAN_STARTUP = os.getenv('LEAN_STARTUP', '0') == '1'
+# preload caches and open connections before serving
+WARM_UP = os.getenv('WARM_UP', '0') == '1'
+WARM_UP_CONNECTIONS = int(os.getenv('WARM_UP_CONNECTIONS', 2))
+# reject new questions that duplicate existing ones
+DUPLICATE_CHECK = os.getenv('DUPLICATE_CHECK', '1') == '1'
+# duplicates listed in a 409 response
+MAX_REPORTED_DUPLICATES = 5
 
 # ----------------------------------------------------------------------------#
 # Formatting
@@ -19,28 +62,506 @@ def format_items(items):
 
     return formatted_items
 
+
+def requested_fields(request):
+    """ Fields named by the `fields` argument, or None when it is absent.
+
+        Names are question fields, or `categories` for the category map
+        of GET /questions. The id is always included; unknown names are a
+        bad request.
+    """
+    fields = request.args.get('fields', None)
+    if fields is None:
+        return None
+
+    names = {name.strip() for name in fields.split(',') if name.strip()}
+    if not names <= set(QUESTION_FIELDS) | {'categories'}:
+        abort(400)
+
+    return ('id',) + tuple(sorted(names - {'id'}))
+
 # ----------------------------------------------------------------------------#
 # Paginate Questions
 # ----------------------------------------------------------------------------#
 
-def paginate_questions(request, selected_items=None):
-    """ Paginate questions by controlling db operations. """
-    questions_limit = request.args.get('limit', QUESTIONS_PER_PAGE, type=int)
+def encode_cursor(question_id):
+    """ Encode the id of the last question on a page as an opaque cursor. """
+    payload = json.dumps({'after_id': question_id}).encode('utf-8')
+
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """ Decode a cursor produced by encode_cursor back into a question id. """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return int(payload['after_id'])
+    except (ValueError, KeyError, TypeError):
+        abort(400)
+
+
+def page_limit(request, default=QUESTIONS_PER_PAGE):
+    """ The `limit` argument, `default` when it is missing; a limit that
+        is not an integer of at least 1 is a bad request.
+    """
+    try:
+        questions_limit = int(request.args.get('limit', default))
+    except ValueError:
+        abort(400)
+    if questions_limit < 1:
+        abort(400)
+
+    return questions_limit
+
+
+def paginate_questions(request, *criteria, fields=None):
+    """ Paginate questions by controlling db operations.
+
+        A `cursor` (or a plain `after_id`) switches to keyset pagination,
+        which seeks on Question.id instead of skipping rows with OFFSET.
+        Only ids are selected; the questions themselves come from the
+        fragment cache. With `fields`, only those columns are selected
+        and serialized instead. Returns the page as JSON fragments and the
+        cursor of the next page.
+    """
+    questions_limit = page_limit(request)
     selected_page = request.args.get('page', 1, type=int)
-    start_index = (selected_page - 1) * questions_limit
-    end_index = start_index + QUESTIONS_PER_PAGE
+    cursor = request.args.get('cursor', None)
+
+    if cursor:
+        after_id = decode_cursor(cursor)
+    else:
+        after_id = request.args.get('after_id', None, type=int)
+
+    if fields is None:
+        columns = (Question.id,)
+    else:
+        columns = [
+            getattr(Question, name) for name in fields
+            if name in QUESTION_FIELDS
+        ]
+    selection = db.session.query(*columns).filter(
+        *criteria
+    ).order_by(Question.id)
 
-    if selected_items:
-        current_questions = selected_items[start_index: end_index]
+    # fetch one extra row to know whether a next page exists
+    if after_id is not None:
+        selection = selection.filter(Question.id > after_id)
     else:
-        current_questions = \
-            Question.query.order_by(Question.id).limit(
+        selection = selection.offset((selected_page - 1) * questions_limit)
+    rows = selection.limit(questions_limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > questions_limit:
+        rows = rows[:questions_limit]
+        next_cursor = encode_cursor(rows[-1].id)
+
+    if fields is None:
+        return load_fragments([row.id for row in rows]), next_cursor
+    return [json_fragment(row._asdict()) for row in rows], next_cursor
+
+# ----------------------------------------------------------------------------#
+# Conditional requests
+# ----------------------------------------------------------------------------#
+
+def request_etag(request, *versions):
+    """ Strong ETag for the current request, derived from the versions of
+        the data it reads, so it can be computed without querying them.
+        The versions include this process's own writes, so another worker,
+        or this one after a restart, may give another ETag for the same
+        response; the client then gets the full response once.
+    """
+    key = repr((
+        request.path,
+        sorted(request.args.items(multi=True)),
+        versions
+    ))
+
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def not_modified(etag):
+    """ Empty 304 response for a client that already holds `etag`. """
+    response = Response(status=304)
+    response.set_etag(etag)
+
+    return response
+
+
+def page_cache_key(request):
+    return (request.path, tuple(sorted(request.args.items(multi=True))))
+
+
+def cached_page(request, etag):
+    """ Cached response for the current list page, if it is still current.
+    """
+    body = response_cache.get(page_cache_key(request), etag)
+    if body is None:
+        return None
+
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+
+    return response
+
+
+def render_page(request, etag, payload, fragments):
+    """ Render a list page from its question fragments, tag it and keep
+        it in the response cache.
+    """
+    response = Response(
+        json_page(payload, fragments), mimetype='application/json')
+    response.set_etag(etag)
+    response_cache.put(page_cache_key(request), etag, response.get_data())
+
+    return response
+
+# ----------------------------------------------------------------------------#
+# Category statistics
+# ----------------------------------------------------------------------------#
+
+def category_stats():
+    """ Question counts of every category, in total and by difficulty,
+        read from the in-process counters.
+    """
+    matrix = question_counts.matrix()
+
+    return {
+        'total_questions': question_counts.total(),
+        'categories': {
+            category_id: {
+                'type': category_type,
+                'total_questions': sum(
+                    matrix.get(category_id, {}).values()),
+                'difficulties': matrix.get(category_id, {})
+            } for category_id, category_type in category_cache.all()
+        }
+    }
+
+# ----------------------------------------------------------------------------#
+# Duplicates
+# ----------------------------------------------------------------------------#
+
+def duplicate_conflict(body):
+    """ 409 payload listing the duplicates of a new question, or None if
+        it has none or the client allows them.
+    """
+    question = body.get('question', None)
+    if not current_app.config['DUPLICATE_CHECK'] or \
+            body.get('allow_duplicate', False) or \
+            not isinstance(question, str):
+        return None
+
+    duplicates = duplicate_index.find(question)
+    if not duplicates:
+        return None
+
+    return {
+        'success': False,
+        'error': 409,
+        'message': "Conflict",
+        'duplicates': [
+            {'id': question_id, 'similarity': round(score, 2)}
+            for question_id, score in duplicates[:MAX_REPORTED_DUPLICATES]
+        ]
+    }
+
+# ----------------------------------------------------------------------------#
+# Quizzes
+# ----------------------------------------------------------------------------#
+
+def draw_formatted_question(category, asked_questions,
+                            target_difficulty=None):
+    question = draw_question(category, asked_questions, target_difficulty)
+
+    return question.format() if question else None
+
+
+def next_quiz(body, draw):
+    """ Answer a quiz request. `draw` takes the category id, the ids
+        already asked and the target difficulty, and returns the next
+        question as a dict, or None.
+    """
+    # clients sending `quiz_state` get a token of the asked questions
+    # back instead of resending all their ids. Without a SECRET_KEY no
+    # token is issued and tokens are rejected.
+    secret_key = current_app.config['SECRET_KEY']
+    use_quiz_state = secret_key is not None and 'quiz_state' in body
+    if use_quiz_state or body.get('quiz_state'):
+        try:
+            asked_questions = decode_quiz_state(
+                body['quiz_state'], secret_key)
+        except ValueError:
+            abort(400)
+
+    try:
+        previous_questions = body.get('previous_questions', None) or []
+        quiz_category = body.get('quiz_category', None)
+
+        if use_quiz_state:
+            asked_questions.update(previous_questions)
+        else:
+            asked_questions = set(previous_questions)
+
+        # adaptive quizzes aim at a difficulty matching the accuracy so far
+        target_difficulty = None
+        if body.get('adaptive', False):
+            target_difficulty = adaptive_target(
+                int(body.get('num_correct', 0)),
+                int(body.get('num_answered', 0)))
+
+        # category 0 is the "ALL" quiz
+        new_question = draw(
+            int(quiz_category['id']), asked_questions, target_difficulty)
+        # clients checking answers with /quizzes/answer don't need it
+        if new_question and body.get('hide_answer', False):
+            del new_question['answer']
+
+        response = {
+            'success': True,
+            'question': new_question
+        }
+        if target_difficulty is not None:
+            response['target_difficulty'] = round(target_difficulty, 2)
+        if use_quiz_state:
+            if new_question:
+                asked_questions.add(new_question['id'])
+            response['quiz_state'] = encode_quiz_state(
+                asked_questions, secret_key)
+
+        return jsonify(response)
+    except:
+        abort(422)
+
+# ----------------------------------------------------------------------------#
+# Snapshot serving
+# ----------------------------------------------------------------------------#
+
+def paginate_snapshot(request, snapshot, question_ids):
+    """ paginate_questions over an ascending id array of a snapshot. """
+    fields = requested_fields(request)
+    questions_limit = page_limit(request)
+    selected_page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', None)
+
+    if cursor:
+        after_id = decode_cursor(cursor)
+    else:
+        after_id = request.args.get('after_id', None, type=int)
+
+    if after_id is not None:
+        start = bisect.bisect_right(question_ids, after_id)
+    else:
+        start = max(0, (selected_page - 1) * questions_limit)
+    page_ids = question_ids[start:start + questions_limit + 1]
+    page_ids = page_ids.tolist()
+
+    next_cursor = None
+    if len(page_ids) > questions_limit:
+        page_ids = page_ids[:questions_limit]
+        next_cursor = encode_cursor(page_ids[-1])
+
+    fragments = snapshot.fragments(page_ids)
+    if fields is not None:
+        fragments = narrow_fragments(fragments, fields)
+
+    return fragments, next_cursor
+
+
+def snapshot_categories(snapshot):
+    etag = request_etag(request, snapshot.version)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    categories_limit = request.args.get('limit', QUESTIONS_PER_PAGE, type=int)
+    selected_page = request.args.get('page', 1, type=int)
+    start_index = (selected_page - 1) * categories_limit
+    current_categories = snapshot.categories()[
+        start_index: start_index + categories_limit
+    ]
+
+    if len(current_categories) == 0:
+        abort(404)
+
+    response = jsonify({
+        'success': True,
+        'categories': dict(current_categories)
+    })
+    response.set_etag(etag)
+
+    return response
+
+
+def snapshot_questions(snapshot):
+    etag = request_etag(request, snapshot.version)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    current_questions, next_cursor = paginate_snapshot(
+        request, snapshot, snapshot.ids)
+
+    if len(current_questions) == 0:
+        abort(404)
+
+    payload = {
+        'success': True,
+        'total_questions': len(snapshot.ids),
+        'current_category': None,
+        'next_cursor': next_cursor
+    }
+    fields = requested_fields(request)
+    if fields is None or 'categories' in fields:
+        payload['categories'] = dict(snapshot.categories())
+
+    response = Response(
+        json_page(payload, current_questions), mimetype='application/json')
+    response.set_etag(etag)
+
+    return response
+
+
+def snapshot_category_questions(snapshot):
+    etag = request_etag(request, snapshot.version)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    category_id = request.view_args['category_id']
+    question_ids = snapshot.category_ids(category_id)
+
+    if len(question_ids) == 0:
+        abort(404)
+
+    current_questions, next_cursor = paginate_snapshot(
+        request, snapshot, question_ids)
+
+    response = Response(json_page({
+        'success': True,
+        'total_questions': len(question_ids),
+        'current_category': snapshot.category_type(category_id),
+        'next_cursor': next_cursor
+    }, current_questions), mimetype='application/json')
+    response.set_etag(etag)
+
+    return response
+
+
+def snapshot_quiz(snapshot):
+    body = request.get_json()
+
+    if body is None:
+        abort(400)
+
+    # snapshots keep no difficulty buckets, so their draws stay uniform
+    def draw(category, asked_questions, target_difficulty=None):
+        question_id = snapshot.draw(category, asked_questions)
+        if question_id is None:
+            return None
+        return snapshot.question(question_id)
+
+    return next_quiz(body, draw)
+
+
+def snapshot_answer(snapshot):
+    body = request.get_json()
+
+    if body is None:
+        abort(400)
+
+    question_id = body.get('question_id', None)
+    guess = body.get('answer', None)
+    if not isinstance(question_id, int) or not isinstance(guess, str):
+        abort(400)
+
+    question = snapshot.question(question_id)
+
+    if question is None:
+        abort(404)
+
+    return jsonify({
+        'success': True,
+        'correct': answer_matches(
+            guess, normalize_answer(question['answer'])),
+        'answer': question['answer']
+    })
+
+
+def snapshot_search(snapshot):
+    body = request.get_json()
+
+    # creating a question still needs the database
+    if body is None or 'searchTerm' not in body:
+        return None
+
+    fields = requested_fields(request)
+    questions_limit = page_limit(request)
+    try:
+        search_string = body['searchTerm'] or ''
+        selected_page = request.args.get('page', 1, type=int)
+        if not search_string:
+            current_questions, _ = paginate_snapshot(
+                request, snapshot, snapshot.ids)
+            total_questions = len(snapshot.ids)
+        else:
+            current_questions, total_questions = snapshot.search(
+                search_string,
+                (selected_page - 1) * questions_limit,
                 questions_limit
-            ).offset(start_index).all()
+            )
+            if fields is not None:
+                current_questions = narrow_fragments(
+                    current_questions, fields)
 
-    formatted_current_questions = format_items(current_questions)
+        return Response(json_page({
+            'success': True,
+            'totalQuestions': total_questions,
+            'currentCategory': None
+        }, current_questions), mimetype='application/json')
+    except:
+        abort(422)
 
-    return formatted_current_questions
+
+# endpoints answered from the snapshot in snapshot mode
+SNAPSHOT_ROUTES = {
+    'get_paginated_categories': snapshot_categories,
+    'get_paginated_questions': snapshot_questions,
+    'get_questions_by_category': snapshot_category_questions,
+    'get_next_quiz': snapshot_quiz,
+    'check_quiz_answer': snapshot_answer,
+    'create_new_question': snapshot_search
+}
+
+# ----------------------------------------------------------------------------#
+# Warm-up
+# ----------------------------------------------------------------------------#
+
+def warm_up(app, connections=True):
+    """ Load the in-memory caches and open database connections, so the
+        first requests of a fresh worker don't pay for them.
+
+        Without `connections`, the pools are emptied again after loading
+        the caches, so workers forked from this process don't inherit
+        open connections.
+    """
+    with app.app_context():
+        category_cache.reload()
+        question_counts.rebuild()
+        quiz_pools.rebuild()
+        answer_index.rebuild()
+        duplicate_index.rebuild()
+        db.session.remove()
+
+        if not connections:
+            db.engine.dispose()
+            return
+
+        opened = [
+            db.engine.connect()
+            for _ in range(app.config['WARM_UP_CONNECTIONS'])
+        ]
+        for connection in opened:
+            connection.close()
+
+        app.extensions['read_replicas'].start()
 
 # ----------------------------------------------------------------------------#
 # Create app
@@ -49,9 +570,44 @@ def paginate_questions(request, selected_items=None):
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    app.config['METRICS_ENABLED'] = METRICS_ENABLED
+    app.config['SECRET_KEY'] = SECRET_KEY
+    app.config['LEAN_STARTUP'] = LEAN_STARTUP
+    app.config['WARM_UP'] = WARM_UP
+    app.config['WARM_UP_CONNECTIONS'] = WARM_UP_CONNECTIONS
+    app.config['SNAPSHOT_PATH'] = SNAPSHOT_PATH
+    app.config['ASYNC_QUESTION_WRITES'] = ASYNC_QUESTION_WRITES
+    app.config['DUPLICATE_CHECK'] = DUPLICATE_CHECK
+    app.config['COMPRESS_MIN_SIZE'] = COMPRESS_MIN_SIZE
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    if app.config['SECRET_KEY'] is None:
+        app.logger.warning(
+            'SECRET_KEY is not set: quiz_state tokens are disabled')
+    # the flask command always gets the `flask db` commands
+    setup_db(app, migrations=not app.config['LEAN_STARTUP'] or
+             click.get_current_context(silent=True) is not None)
     CORS(app)
 
+    if app.config['METRICS_ENABLED']:
+        init_metrics(app)
+    leaderboard.init_app(app)
+    question_writes.init_app(app)
+
+    if app.config['SNAPSHOT_PATH']:
+        app.extensions['snapshot'] = SnapshotStore(app.config['SNAPSHOT_PATH'])
+
+        @app.before_request
+        def serve_snapshot():
+            handler = SNAPSHOT_ROUTES.get(request.endpoint)
+            if handler is not None:
+                return handler(app.extensions['snapshot'].current())
+
+    @app.before_request
+    def route_reads():
+        if request.method == 'GET':
+            use_read_replica()
+
     @app.after_request
     def after_request(response):
         response.headers.add(
@@ -62,76 +618,128 @@ def create_app(test_config=None):
             'Access-Control-Allow-Methods',
             'GET,POST,DELETE,OPTIONS'
         )
-        return response
+        return compress_response(
+            request, response, app.config['COMPRESS_MIN_SIZE'])
 
     @app.route('/categories')
     def get_paginated_categories():
         """ Get all vailable categories, paginated. """
+        etag = request_etag(request, category_cache.etag_version())
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
         categories_limit = request.args.get('limit', QUESTIONS_PER_PAGE, type=int)
         selected_page = request.args.get('page', 1, type=int)
         start_index = (selected_page - 1) * categories_limit
-        
-        current_categories = \
-            Category.query.order_by(Category.id).limit(
-                categories_limit
-            ).offset(start_index).all()
+
+        current_categories = category_cache.all()[
+            start_index: start_index + categories_limit
+        ]
 
         if len(current_categories) == 0:
             abort(404)
 
-        formatted_categories = format_items(current_categories)
         categories_dict = {}
-        for category in formatted_categories:
-            key = category['id']
-            value = category['type']
-            categories_dict[key] = value
+        for category_id, category_type in current_categories:
+            categories_dict[category_id] = category_type
 
-        return jsonify({
+        response = jsonify({
             'success': True,
             'categories': categories_dict
         })
+        response.set_etag(etag)
+
+        return response
 
     @app.route('/questions')
     def get_paginated_questions():
         """ Get all questions, paginated. """
-        total_questions = len(Question.query.all())
-        current_questions = paginate_questions(request)
+        etag = request_etag(
+            request, category_cache.etag_version(), generations.total()
+        )
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        cached_response = cached_page(request, etag)
+        if cached_response is not None:
+            return cached_response
+
+        fields = requested_fields(request)
+        total_questions = question_counts.total()
+        current_questions, next_cursor = paginate_questions(
+            request, fields=fields)
 
         if len(current_questions) == 0:
             abort(404)
 
-        categories = Category.query.order_by(Category.id).all()
-        categories_dict = {
-            category.id: category.type for category in categories
-        }
-
-        return jsonify({
+        payload = {
             'success': True,
-            'questions': current_questions,
             'total_questions': total_questions,
-            'categories': categories_dict,
-            'current_category': None
-        })
+            'current_category': None,
+            'next_cursor': next_cursor
+        }
+        if fields is None or 'categories' in fields:
+            payload['categories'] = category_cache.as_dict()
+
+        return render_page(request, etag, payload, current_questions)
 
     @app.route('/categories/<int:category_id>/questions')
     def get_questions_by_category(category_id):
         """ Get questions based the chosen category. """
-        candidate_questions = \
-            Question.query.filter_by(
-                category=str(category_id)
-            ).order_by(Question.id).all()
+        etag = request_etag(
+            request,
+            category_cache.etag_version(),
+            generations.category(category_id)
+        )
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        cached_response = cached_page(request, etag)
+        if cached_response is not None:
+            return cached_response
 
-        if len(candidate_questions) == 0:
+        total_questions = question_counts.count(category_id)
+
+        if total_questions == 0:
             abort(404)
-            
-        current_questions = paginate_questions(request, candidate_questions)
-        chosen_category = Category.query.get(category_id).type
 
+        current_questions, next_cursor = paginate_questions(
+            request, Question.category == category_id,
+            fields=requested_fields(request)
+        )
+        chosen_category = category_cache.get(category_id)
+
+        return render_page(request, etag, {
+            'success': True,
+            'total_questions': total_questions,
+            'current_category': chosen_category,
+            'next_cursor': next_cursor
+        }, current_questions)
+
+    @app.route('/categories/stats')
+    def get_category_stats():
+        """ Get question counts per category and difficulty. """
         return jsonify({
             'success': True,
-            'questions': current_questions,
-            'total_questions': len(candidate_questions),
-            'current_category': chosen_category
+            **category_stats()
+        })
+
+    @app.route('/categories/stats/rebuild', methods=['POST'])
+    def rebuild_category_stats():
+        """ Recount the question counters of this process from the
+            database and return the statistics.
+        """
+        question_counts.rebuild()
+
+        return jsonify({
+            'success': True,
+            **category_stats()
+        })
+
+    @app.route('/cache/stats')
+    def get_cache_stats():
+        """ Get hit, miss and eviction counts of the response cache. """
+        return jsonify({
+            'success': True,
+            **response_cache.stats()
         })
 
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
@@ -161,37 +769,103 @@ def create_app(test_config=None):
         if body is None:
             abort(400)
 
-        try:
-            previous_questions = body.get('previous_questions', None)
-            quiz_category = body.get('quiz_category', None)
+        use_read_replica()
 
-            if not previous_questions:
-                candidate_questions = Question.query.filter_by(
-                    category=quiz_category['id']
-                ).all()
-            else:
-                candidate_questions = Question.query.filter_by(
-                    category=quiz_category['id']
-                ).filter(Question.id.notin_(previous_questions)).all()
-
-            # answered all questions
-            if len(candidate_questions) != 0:
-                formatted_candidate_questions = [
-                    candidate.format() for candidate in candidate_questions
-                ]
-                random_id = random.randint(0, len(candidate_questions) - 1)
-                new_question = formatted_candidate_questions[random_id]
-            else:
-                new_question = None
-            # print(new_question)
+        return next_quiz(body, draw_formatted_question)
 
-            return jsonify({
-                'success': True,
-                'question': new_question
-            })
-        except:
+    @app.route('/quizzes/answer', methods=['POST'])
+    def check_quiz_answer():
+        """ Check a guess against the answer of a quiz question. """
+        body = request.get_json()
+
+        if body is None:
+            abort(400)
+
+        question_id = body.get('question_id', None)
+        guess = body.get('answer', None)
+        if not isinstance(question_id, int) or not isinstance(guess, str):
+            abort(400)
+
+        use_read_replica()
+        checked = answer_index.check(question_id, guess)
+
+        if checked is None:
+            abort(404)
+
+        correct, answer = checked
+
+        return jsonify({
+            'success': True,
+            'correct': correct,
+            'answer': answer
+        })
+
+    @app.route('/scores', methods=['POST'])
+    def submit_score():
+        """ Submit the final score of a quiz. """
+        body = request.get_json()
+
+        if body is None:
+            abort(400)
+
+        try:
+            player, score, category = validate_score(body)
+        except (TypeError, ValueError):
+            abort(400)
+
+        if category is not None and category_cache.get(category) is None:
             abort(422)
 
+        try:
+            best_score, rank = leaderboard.submit(player, score, category)
+        except queue.Full:
+            abort(503)
+
+        return jsonify({
+            'success': True,
+            'player': player,
+            'best_score': best_score,
+            'rank': rank
+        })
+
+    @app.route('/leaderboard')
+    def get_leaderboard():
+        """ Get the best players, overall or of a category. """
+        category = request.args.get('category', None, type=int) or None
+        limit = min(page_limit(request, 10), 100)
+        selected_page = request.args.get('page', 1, type=int)
+        if selected_page < 1:
+            abort(404)
+
+        players, total_players = leaderboard.top(
+            category, limit, (selected_page - 1) * limit)
+
+        return jsonify({
+            'success': True,
+            'leaderboard': players,
+            'total_players': total_players,
+            'category': category
+        })
+
+    @app.route('/leaderboard/<string:player>')
+    def get_player_standing(player):
+        """ Get the best score and rank of a player. """
+        category = request.args.get('category', None, type=int) or None
+        standing = leaderboard.standing(player, category)
+
+        if standing is None:
+            abort(404)
+
+        best_score, rank = standing
+
+        return jsonify({
+            'success': True,
+            'player': player,
+            'best_score': best_score,
+            'rank': rank,
+            'category': category
+        })
+
     @app.route('/questions', methods=['POST'])
     def create_new_question():
         """ Create a new question. """
@@ -202,19 +876,25 @@ def create_app(test_config=None):
         
         if 'searchTerm' in body:
             return search_questions(body)
+
+        conflict = duplicate_conflict(body)
+        if conflict is not None:
+            return jsonify(conflict), 409
+
+        if app.config['ASYNC_QUESTION_WRITES']:
+            return enqueue_question(body)
         else:
             # print("**** Start Create ****")
             try:
-                question = body.get('question', None)
-                answer = body.get('answer', None)
-                difficulty = body.get('difficulty', None)
-                category = body.get('category', None)
-                new_question = Question(
-                    question=question,
-                    answer=answer,
-                    difficulty=difficulty,
-                    category=category
-                )
+                row = validate_question(body)
+            except ValueError:
+                abort(422)
+
+            if category_cache.get(row['category']) is None:
+                abort(422)
+
+            try:
+                new_question = Question(**row)
                 new_question.insert()
 
                 return jsonify({
@@ -223,30 +903,241 @@ def create_app(test_config=None):
             except:
                 abort(422)
 
+    def enqueue_question(body):
+        """ Validate a new question and queue it for a background write. """
+        try:
+            row = validate_question(body)
+        except ValueError:
+            abort(422)
+
+        if category_cache.get(row['category']) is None:
+            abort(422)
+
+        try:
+            ticket = question_writes.submit(
+                row,
+                check_duplicates=app.config['DUPLICATE_CHECK'] and
+                not body.get('allow_duplicate', False))
+        except queue.Full:
+            abort(503)
+
+        response = jsonify({
+            'success': True,
+            'ticket': ticket
+        })
+        response.status_code = 202
+        response.headers['Location'] = '/questions/tickets/{}'.format(ticket)
+
+        return response
+
+    @app.route('/questions/tickets/<string:ticket>')
+    def get_question_ticket(ticket):
+        """ Get the write status of a queued question. """
+        status = question_writes.status(ticket)
+
+        if status is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'ticket': ticket,
+            **status
+        })
+
+    @app.route('/questions/batch', methods=['POST'])
+    def create_question_batch():
+        """ Create many questions in a single transaction. """
+        body = request.get_json()
+
+        if body is None:
+            abort(400)
+
+        payloads = body.get('questions', None)
+        if not isinstance(payloads, list) or \
+                not 0 < len(payloads) <= MAX_BATCH_SIZE:
+            abort(400)
+
+        check_duplicates = app.config['DUPLICATE_CHECK'] and \
+            not body.get('allow_duplicates', False)
+        try:
+            results = create_questions(payloads, check_duplicates)
+        except:
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'created': sum(1 for result in results if result['success']),
+            'results': results
+        })
+
+    @app.route('/questions/batch', methods=['DELETE'])
+    def delete_question_batch():
+        """ Delete many questions in a single transaction. """
+        body = request.get_json()
+
+        if body is None:
+            abort(400)
+
+        question_ids = body.get('ids', None)
+        if not isinstance(question_ids, list) or \
+                not 0 < len(question_ids) <= MAX_BATCH_SIZE or \
+                not all(isinstance(item, int) for item in question_ids):
+            abort(400)
+
+        try:
+            results = delete_questions(question_ids)
+        except:
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'deleted': sum(1 for result in results if result['success']),
+            'results': results
+        })
+
+    @app.route('/questions/import', methods=['POST'])
+    def import_new_questions():
+        """ Bulk import questions streamed as NDJSON or CSV. """
+        file_format = request.args.get('format', None)
+        if file_format is None:
+            file_format = 'csv' if request.mimetype == 'text/csv' \
+                else 'ndjson'
+
+        if file_format == 'csv':
+            records = iter_csv(request.stream)
+        elif file_format == 'ndjson':
+            records = iter_ndjson(request.stream)
+        else:
+            abort(400)
+
+        check_duplicates = app.config['DUPLICATE_CHECK'] and \
+            request.args.get('allow_duplicates', '0') != '1'
+        report = import_questions(records, check_duplicates=check_duplicates)
+
+        return jsonify({
+            'success': True,
+            **report.format()
+        })
+
+    @app.route('/questions/export')
+    def export_all_questions():
+        """ Stream questions as NDJSON, optionally filtered. """
+        category = request.args.get('category', None, type=int)
+        difficulty = request.args.get('difficulty', None, type=int)
+
+        return Response(
+            stream_with_context(export_questions(category, difficulty)),
+            mimetype='application/x-ndjson'
+        )
+
     @app.route('/questions', methods=['POST'])
     def search_questions(body):
         """ Search questions based on search string. """
         # print("**** Start Search ****")
 
         search_string = body['searchTerm']
+        fields = requested_fields(request)
+        questions_limit = page_limit(request)
+        use_read_replica()
         try:
             if not search_string:
-                current_questions = paginate_questions(request)
+                current_questions, next_cursor = paginate_questions(
+                    request, fields=fields)
+                total_questions = question_counts.total()
             else:
-                candidate_questions = Question.query.order_by(Question.id).filter(
-                    Question.question.ilike('%{}%'.format(search_string))
-                ).all()
-                current_questions = paginate_questions(request, candidate_questions)
+                selected_page = request.args.get('page', 1, type=int)
+                columns = QUESTION_COLUMNS if fields is None else [
+                    getattr(Question, name) for name in fields
+                    if name in QUESTION_FIELDS
+                ]
+                rows, total_questions = get_search_backend().search(
+                    search_string,
+                    (selected_page - 1) * questions_limit,
+                    questions_limit,
+                    columns
+                )
+                current_questions = [
+                    json_fragment(row._asdict()) for row in rows
+                ]
 
-            return jsonify({
+            return Response(json_page({
                 'success': True,
-                'questions': current_questions,
-                'totalQuestions': len(candidate_questions),
+                'totalQuestions': total_questions,
                 'currentCategory': None
-            })
+            }, current_questions), mimetype='application/json')
         except:
             abort(422)
 
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'file_format',
+                  type=click.Choice(['ndjson', 'csv']), default=None,
+                  help='Defaults to csv for .csv files, ndjson otherwise.')
+    @click.option('--allow-duplicates', is_flag=True,
+                  help='Import questions duplicating existing ones.')
+    def import_questions_command(path, file_format, allow_duplicates):
+        """ Import questions from an NDJSON or CSV file. """
+        if file_format is None:
+            file_format = 'csv' if path.endswith('.csv') else 'ndjson'
+        check_duplicates = app.config['DUPLICATE_CHECK'] and \
+            not allow_duplicates
+
+        # decoded line by line, so invalid UTF-8 is reported per line
+        with open(path, 'rb') as lines:
+            if file_format == 'csv':
+                records = iter_csv(lines)
+            else:
+                records = iter_ndjson(lines)
+            report = import_questions(
+                records, check_duplicates=check_duplicates)
+
+        click.echo(json.dumps(report.format(), indent=2))
+
+    @app.cli.command('dedup-report')
+    @click.option('--threshold', type=float, default=DUPLICATE_SIMILARITY,
+                  help='Estimated similarity from which questions are '
+                       'duplicates.')
+    def dedup_report_command(threshold):
+        """ Report groups of duplicate questions already in the table. """
+        groups = duplicate_groups(threshold)
+        grouped_ids = [question_id for ids in groups for question_id in ids]
+        texts = dict(db.session.query(Question.id, Question.question).filter(
+            Question.id.in_(grouped_ids)))
+
+        click.echo(json.dumps({
+            'groups': len(groups),
+            'duplicates': len(grouped_ids) - len(groups),
+            'questions': [
+                [{'id': question_id, 'question': texts[question_id]}
+                 for question_id in ids]
+                for ids in groups
+            ]
+        }, indent=2))
+
+    @app.cli.command('export-questions')
+    @click.argument('output', type=click.File('w'), default='-')
+    @click.option('--category', type=int, default=None)
+    @click.option('--difficulty', type=int, default=None)
+    def export_questions_command(output, category, difficulty):
+        """ Export questions as NDJSON to a file or stdout. """
+        for line in export_questions(category, difficulty):
+            output.write(line)
+
+    @app.cli.command('snapshot-questions')
+    @click.argument('path', type=click.Path(dir_okay=False))
+    def snapshot_questions_command(path):
+        """ Compile the question bank into a snapshot for SNAPSHOT_PATH. """
+        click.echo('Wrote {} questions to {}'.format(
+            write_snapshot(path), path))
+
+    @app.cli.command('stats-report')
+    def stats_report_command():
+        """ Count questions per category and difficulty in the database and
+            print them. The counters of running servers are not changed.
+        """
+        question_counts.rebuild()
+        click.echo(json.dumps(category_stats(), indent=2, sort_keys=True))
+
     @app.errorhandler(404)
     def not_found(error):
         return jsonify({
@@ -279,4 +1170,20 @@ def create_app(test_config=None):
             'message': "Bad Request"
         }), 400
 
+    @app.errorhandler(503)
+    def unavailable(error):
+        response = jsonify({
+            'success': False,
+            'error': 503,
+            'message': "Service Unavailable"
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+
+        return response
+
+    if app.config['WARM_UP']:
+        # workers forked after this open their connections in warm_up()
+        warm_up(app, connections=False)
+
     return app
@@ -0,0 +1,171 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from models import db, Question, on_question_change, primary_reads
+
+ARTICLES = frozenset(['a', 'an', 'the'])
+# one typo tolerated per this many characters of the answer, at most two
+CHARACTERS_PER_TYPO = 5
+MAX_TYPOS = 2
+ANSWERS_MAX_AGE = int(os.getenv('ANSWERS_MAX_AGE', 300))
+
+# ----------------------------------------------------------------------------#
+# Answer normalization
+# ----------------------------------------------------------------------------#
+
+
+def normalize_answer(text):
+    """ Case-fold, strip accents, punctuation and articles, and collapse
+        whitespace, so "The Liver!" and "liver" compare equal. An answer
+        made only of articles keeps them.
+    """
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(
+        character for character in text
+        if not unicodedata.combining(character)
+    )
+    words = re.sub(r'[^\w\s]', ' ', text).split()
+
+    return ' '.join(
+        [word for word in words if word not in ARTICLES] or words)
+
+
+def within_distance(first, second, max_distance):
+    """ Whether the Levenshtein distance of the two strings is at most
+        max_distance. Only a band of 2 * max_distance + 1 cells per row is
+        computed, and the scan stops as soon as the band exceeds the limit.
+    """
+    if abs(len(first) - len(second)) > max_distance:
+        return False
+    if max_distance == 0:
+        return first == second
+
+    too_far = max_distance + 1
+    previous = list(range(len(second) + 1))
+    for row, first_character in enumerate(first, 1):
+        current = [too_far] * (len(second) + 1)
+        current[0] = row
+        start = max(1, row - max_distance)
+        end = min(len(second), row + max_distance)
+        for column in range(start, end + 1):
+            cost = 0 if first_character == second[column - 1] else 1
+            current[column] = min(
+                previous[column] + 1,
+                current[column - 1] + 1,
+                previous[column - 1] + cost,
+                too_far
+            )
+        if min(current[start - 1:end + 1]) > max_distance:
+            return False
+        previous = current
+
+    return previous[len(second)] <= max_distance
+
+
+def allowed_typos(normalized_answer):
+    return min(MAX_TYPOS, len(normalized_answer) // CHARACTERS_PER_TYPO)
+
+
+def answer_matches(guess, normalized_answer):
+    """ Whether a raw guess answers a question, typos allowed except in
+        numbers, so "Apollo 12" doesn't answer "Apollo 13".
+    """
+    guess = normalize_answer(guess)
+    if not guess:
+        return False
+    if guess == normalized_answer:
+        return True
+
+    return re.findall(r'\d+', guess) == \
+        re.findall(r'\d+', normalized_answer) and within_distance(
+            guess, normalized_answer, allowed_typos(normalized_answer))
+
+# ----------------------------------------------------------------------------#
+# Answer index
+# ----------------------------------------------------------------------------#
+
+
+class AnswerIndex:
+    """ Answer of every question with its normalized form, computed once
+        and kept in step with question changes, so checking a guess
+        usually doesn't read the database. The index is reloaded every
+        ANSWERS_MAX_AGE seconds, and a question missing from it, such as
+        one just added by another process, is looked up on its own.
+    """
+
+    def __init__(self, max_age=ANSWERS_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._answers = None
+        self._loaded_at = 0
+
+    def rebuild(self):
+        answers = {
+            question_id: (normalize_answer(answer), answer)
+            for question_id, answer in db.session.query(
+                Question.id, Question.answer)
+        }
+        with self._lock:
+            self._answers = answers
+            self._loaded_at = time.time()
+
+        return answers
+
+    def invalidate(self):
+        with self._lock:
+            self._answers = None
+
+    def on_change(self, action, question):
+        with self._lock:
+            if self._answers is None:
+                return
+            if action in ('insert', 'update'):
+                self._answers[question.id] = (
+                    normalize_answer(question.answer), question.answer)
+            elif action == 'delete':
+                self._answers.pop(question.id, None)
+            else:
+                self._answers = None
+
+    def _ensure_loaded(self):
+        """ The answers, reloaded first if they are missing or stale. """
+        answers = self._answers
+        if answers is None or time.time() - self._loaded_at > self.max_age:
+            answers = self.rebuild()
+        return answers
+
+    def _load_one(self, question_id):
+        # read from the primary: a replica may not have a new question yet
+        with primary_reads():
+            answer = db.session.query(Question.answer).filter(
+                Question.id == question_id).scalar()
+        if answer is None:
+            return None
+
+        entry = (normalize_answer(answer), answer)
+        with self._lock:
+            if self._answers is not None:
+                self._answers[question_id] = entry
+
+        return entry
+
+    def check(self, question_id, guess):
+        """ (whether the guess answers the question, the actual answer), or
+            None if there is no such question.
+        """
+        entry = self._ensure_loaded().get(question_id)
+        if entry is None:
+            entry = self._load_one(question_id)
+        if entry is None:
+            return None
+
+        normalized_answer, answer = entry
+
+        return answer_matches(guess, normalized_answer), answer
+
+
+answer_index = AnswerIndex()
+on_question_change(answer_index.on_change)
@@ -0,0 +1,596 @@
+""" ASGI serving mode for the read and quiz routes.
+
+Run it with any ASGI server, e.g. `uvicorn flaskr.asgi:app`. Queries go
+through an async driver -- aiosqlite for SQLite, asyncpg for Postgres --
+so a single process can keep many quiz sessions waiting on the database
+at once. Responses follow the JSON contracts of the Flask app.
+
+The app shares the Flask app's in-process state: the category cache,
+question counters, quiz pools, duplicate index, response cache and the
+question change listeners. Calls into that state run on a worker thread
+in the Flask app's context, since any of them may reload from the
+database through the sync session; the page, quiz and search queries
+themselves go through the async driver.
+"""
+import asyncio
+import json
+import os
+import re
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.exceptions import HTTPException, abort
+from werkzeug.http import parse_etags, quote_etag
+
+from models import (
+    DB_PATH, DB_POOL_SIZE, notify_question_change, question_counts, setup_db
+)
+from . import (
+    QUESTIONS_PER_PAGE, create_app, decode_cursor, duplicate_conflict,
+    encode_cursor, page_cache_key, page_limit, request_etag,
+    requested_fields
+)
+from .cache import category_cache, generations, response_cache
+from .fragments import QUESTION_FIELDS, json_fragment, json_page
+from .quiz import (
+    adaptive_target, decode_quiz_state, encode_quiz_state, quiz_pools
+)
+from .search import like_pattern
+from .transfer import detached_question, validate_question
+
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL', DB_PATH)
+SELECT_QUESTIONS = 'SELECT {} FROM questions'.format(', '.join(QUESTION_FIELDS))
+ERROR_MESSAGES = {
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Not Allowed Method",
+    422: "Unprocessable"
+}
+
+# ----------------------------------------------------------------------------#
+# Async databases
+# ----------------------------------------------------------------------------#
+
+
+class SqliteDatabase:
+    """ A fixed pool of aiosqlite connections. Each connection runs its
+        queries on its own thread, so the pool size bounds how many
+        queries are in flight.
+    """
+
+    search_filter = "lower(question) LIKE lower(?) ESCAPE '\\'"
+
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._connections = None
+
+    async def connect(self):
+        import aiosqlite
+
+        self._connections = asyncio.Queue()
+        for _ in range(self.size):
+            self._connections.put_nowait(await aiosqlite.connect(self.path))
+
+    async def fetch(self, sql, *args):
+        connection = await self._connections.get()
+        try:
+            return await connection.execute_fetchall(sql, args)
+        finally:
+            self._connections.put_nowait(connection)
+
+    async def insert(self, sql, *args):
+        """ Run an INSERT, commit it and return the new row id. """
+        connection = await self._connections.get()
+        try:
+            cursor = await connection.execute(sql, args)
+            await connection.commit()
+            return cursor.lastrowid
+        finally:
+            self._connections.put_nowait(connection)
+
+    async def close(self):
+        while not self._connections.empty():
+            await self._connections.get_nowait().close()
+
+
+class PostgresDatabase:
+    """ An asyncpg connection pool. Queries are written with `?`
+        placeholders and numbered for asyncpg.
+    """
+
+    search_filter = "question ILIKE ? ESCAPE '\\'"
+
+    def __init__(self, url, size=DB_POOL_SIZE):
+        self.url = url
+        self.size = size
+        self._pool = None
+
+    @staticmethod
+    def numbered(sql):
+        counter = iter(range(1, sql.count('?') + 1))
+        return re.sub(r'\?', lambda match: '${}'.format(next(counter)), sql)
+
+    async def connect(self):
+        import asyncpg
+
+        self._pool = await asyncpg.create_pool(
+            self.url, min_size=1, max_size=self.size)
+
+    async def fetch(self, sql, *args):
+        async with self._pool.acquire() as connection:
+            return await connection.fetch(self.numbered(sql), *args)
+
+    async def insert(self, sql, *args):
+        async with self._pool.acquire() as connection:
+            return await connection.fetchval(
+                self.numbered(sql) + ' RETURNING id', *args)
+
+    async def close(self):
+        await self._pool.close()
+
+
+def database_for(url):
+    """ The async database for a SQLAlchemy-style URL. """
+    if url.startswith('sqlite:///'):
+        return SqliteDatabase(url[len('sqlite:///'):])
+    if url.startswith(('postgresql://', 'postgres://')):
+        return PostgresDatabase(url)
+    raise ValueError('no async driver for {}'.format(url))
+
+# ----------------------------------------------------------------------------#
+# Requests and responses
+# ----------------------------------------------------------------------------#
+
+
+class Request:
+    """ The parts of an ASGI request the routes read, shaped like Flask's
+        request so the Flask app's helpers accept it.
+    """
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = MultiDict(parse_qsl(
+            scope['query_string'].decode('latin-1'), keep_blank_values=True))
+        self.headers = Headers([
+            (name.decode('latin-1'), value.decode('latin-1'))
+            for name, value in scope.get('headers', ())
+        ])
+        self.if_none_match = parse_etags(self.headers.get('If-None-Match'))
+        self.body = body
+
+    def get_json(self):
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except ValueError:
+            return None
+
+
+async def read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+def reply(body, status=200, etag=None):
+    """ (status, body, extra headers) of a JSON response. """
+    headers = []
+    if etag is not None:
+        headers.append((b'etag', quote_etag(etag).encode('ascii')))
+    return status, body, headers
+
+
+def not_modified(etag):
+    return reply(b'', 304, etag)
+
+
+async def send_json(send, status, body, headers=()):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('ascii')),
+            (b'access-control-allow-origin', b'*'),
+            (b'access-control-allow-headers',
+             b'Content-Type,Authorization,true'),
+            (b'access-control-allow-methods', b'GET,POST,DELETE,OPTIONS'),
+            *headers
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def select_questions(fields=None):
+    """ SELECT of the question columns, or only of the requested fields. """
+    if fields is None:
+        return QUESTION_FIELDS, SELECT_QUESTIONS
+    columns = tuple(name for name in fields if name in QUESTION_FIELDS)
+    return columns, 'SELECT {} FROM questions'.format(', '.join(columns))
+
+# ----------------------------------------------------------------------------#
+# ASGI app
+# ----------------------------------------------------------------------------#
+
+
+class TriviaASGI:
+    """ The category, question list, search and quiz routes over an async
+        database, sharing the in-process state of `flask_app`, a Flask app
+        set up on the same database.
+    """
+
+    def __init__(self, database_url=ASYNC_DATABASE_URL, flask_app=None):
+        if flask_app is None:
+            flask_app = create_app()
+            setup_db(flask_app, database_url)
+        self.flask_app = flask_app
+        self.database = database_for(database_url)
+        self.secret_key = flask_app.config['SECRET_KEY']
+        self._started = False
+        self._start_lock = asyncio.Lock()
+        self.routes = [
+            ('GET', re.compile(r'/categories$'), self.get_categories),
+            ('GET', re.compile(r'/questions$'), self.get_questions),
+            ('GET', re.compile(r'/categories/(\d+)/questions$'),
+             self.get_questions_by_category),
+            ('POST', re.compile(r'/quizzes$'), self.get_next_quiz),
+            ('POST', re.compile(r'/questions$'), self.create_or_search)
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            request = Request(scope, await read_body(receive))
+            await send_json(send, *await self.dispatch(request))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        async with self._start_lock:
+            if not self._started:
+                await self.database.connect()
+                self._started = True
+
+    async def shutdown(self):
+        async with self._start_lock:
+            if self._started:
+                await self.database.close()
+                self._started = False
+
+    async def dispatch(self, request):
+        if not self._started:
+            await self.startup()
+
+        if request.method == 'OPTIONS':
+            return reply('')
+
+        path_found = False
+        for method, pattern, handler in self.routes:
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            path_found = True
+            if method != request.method:
+                continue
+            try:
+                return await handler(request, *match.groups())
+            except HTTPException as error:
+                return reply(self.error_body(error.code), error.code)
+
+        status = 405 if path_found else 404
+        return reply(self.error_body(status), status)
+
+    @staticmethod
+    def error_body(status):
+        return json_fragment({
+            'success': False,
+            'error': status,
+            'message': ERROR_MESSAGES[status]
+        }) + '\n'
+
+    async def call(self, function, *args):
+        """ Run `function` on a worker thread in the Flask app's context.
+
+            The shared state reloads itself from the database, with the sync
+            session, whenever it is stale; that must not block the loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._call_in_app_context, function, args)
+
+    def _call_in_app_context(self, function, args):
+        with self.flask_app.app_context():
+            return function(*args)
+
+    # ------------------------------------------------------------------------#
+    # Routes
+    # ------------------------------------------------------------------------#
+
+    async def paginate_questions(self, request, where=None, params=(),
+                                 fields=None):
+        """ paginate_questions of the Flask app, in one query. """
+        questions_limit = page_limit(request)
+        selected_page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor', None)
+
+        if cursor:
+            after_id = decode_cursor(cursor)
+        else:
+            after_id = request.args.get('after_id', None, type=int)
+
+        columns, sql = select_questions(fields)
+        conditions = [where] if where else []
+        params = list(params)
+        if after_id is not None:
+            conditions.append('id > ?')
+            params.append(after_id)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        # fetch one extra row to know whether a next page exists
+        sql += ' ORDER BY id LIMIT ?'
+        params.append(questions_limit + 1)
+        if after_id is None:
+            sql += ' OFFSET ?'
+            params.append(max(0, (selected_page - 1) * questions_limit))
+
+        rows = await self.database.fetch(sql, *params)
+
+        next_cursor = None
+        if len(rows) > questions_limit:
+            rows = rows[:questions_limit]
+            next_cursor = encode_cursor(rows[-1][0])
+
+        return [
+            json_fragment(dict(zip(columns, row))) for row in rows
+        ], next_cursor
+
+    async def get_categories(self, request):
+        etag = await self.call(
+            lambda: request_etag(request, category_cache.etag_version()))
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        categories_limit = request.args.get(
+            'limit', QUESTIONS_PER_PAGE, type=int)
+        selected_page = request.args.get('page', 1, type=int)
+        start_index = (selected_page - 1) * categories_limit
+
+        current_categories = (await self.call(category_cache.all))[
+            start_index: start_index + categories_limit
+        ]
+
+        if len(current_categories) == 0:
+            abort(404)
+
+        return reply(json_fragment({
+            'success': True,
+            'categories': dict(current_categories)
+        }) + '\n', etag=etag)
+
+    async def get_questions(self, request):
+        etag = await self.call(lambda: request_etag(
+            request, category_cache.etag_version(), generations.total()))
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        body = response_cache.get(page_cache_key(request), etag)
+        if body is not None:
+            return reply(body, etag=etag)
+
+        fields = requested_fields(request)
+        current_questions, next_cursor = await self.paginate_questions(
+            request, fields=fields)
+
+        if len(current_questions) == 0:
+            abort(404)
+
+        total_questions, categories = await self.call(
+            lambda: (question_counts.total(), category_cache.as_dict()))
+        payload = {
+            'success': True,
+            'total_questions': total_questions,
+            'current_category': None,
+            'next_cursor': next_cursor
+        }
+        if fields is None or 'categories' in fields:
+            payload['categories'] = categories
+
+        return self.render_page(request, etag, payload, current_questions)
+
+    async def get_questions_by_category(self, request, category_id):
+        category_id = int(category_id)
+        etag = await self.call(lambda: request_etag(
+            request,
+            category_cache.etag_version(),
+            generations.category(category_id)
+        ))
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        body = response_cache.get(page_cache_key(request), etag)
+        if body is not None:
+            return reply(body, etag=etag)
+
+        total_questions, chosen_category = await self.call(lambda: (
+            question_counts.count(category_id),
+            category_cache.get(category_id)
+        ))
+
+        if total_questions == 0:
+            abort(404)
+
+        current_questions, next_cursor = await self.paginate_questions(
+            request, 'category = ?', (category_id,),
+            fields=requested_fields(request))
+
+        return self.render_page(request, etag, {
+            'success': True,
+            'total_questions': total_questions,
+            'current_category': chosen_category,
+            'next_cursor': next_cursor
+        }, current_questions)
+
+    @staticmethod
+    def render_page(request, etag, payload, fragments):
+        """ render_page of the Flask app: the page is kept in the shared
+            response cache under the same key and ETag.
+        """
+        body = json_page(payload, fragments).encode('utf-8')
+        response_cache.put(page_cache_key(request), etag, body)
+
+        return reply(body, etag=etag)
+
+    async def draw_question(self, category, asked_questions,
+                            target_difficulty=None):
+        """ A random question as a dict, skipping ids deleted since the
+            pools were loaded.
+        """
+        while True:
+            question_id = await self.call(
+                quiz_pools.draw, category, asked_questions, target_difficulty)
+            if question_id is None:
+                return None
+            rows = await self.database.fetch(
+                SELECT_QUESTIONS + ' WHERE id = ?', question_id)
+            if rows:
+                return dict(zip(QUESTION_FIELDS, rows[0]))
+            quiz_pools.discard(question_id)
+
+    async def get_next_quiz(self, request):
+        body = request.get_json()
+
+        if body is None:
+            abort(400)
+
+        use_quiz_state = self.secret_key is not None and 'quiz_state' in body
+        if use_quiz_state or body.get('quiz_state'):
+            try:
+                asked_questions = decode_quiz_state(
+                    body['quiz_state'], self.secret_key)
+            except ValueError:
+                abort(400)
+
+        try:
+            previous_questions = body.get('previous_questions', None) or []
+            category = int(body.get('quiz_category', None)['id'])
+            target_difficulty = None
+            if body.get('adaptive', False):
+                target_difficulty = adaptive_target(
+                    int(body.get('num_correct', 0)),
+                    int(body.get('num_answered', 0)))
+
+            if use_quiz_state:
+                asked_questions.update(previous_questions)
+            else:
+                asked_questions = set(previous_questions)
+        except Exception:
+            abort(422)
+
+        # category 0 is the "ALL" quiz
+        new_question = await self.draw_question(
+            category, asked_questions, target_difficulty)
+        if new_question and body.get('hide_answer', False):
+            del new_question['answer']
+
+        response = {
+            'success': True,
+            'question': new_question
+        }
+        if target_difficulty is not None:
+            response['target_difficulty'] = round(target_difficulty, 2)
+        if use_quiz_state:
+            if new_question:
+                asked_questions.add(new_question['id'])
+            response['quiz_state'] = encode_quiz_state(
+                asked_questions, self.secret_key)
+
+        return reply(json_fragment(response) + '\n')
+
+    async def create_or_search(self, request):
+        body = request.get_json()
+
+        if body is None:
+            abort(400)
+
+        if 'searchTerm' in body:
+            return await self.search_questions(request, body['searchTerm'])
+
+        conflict = await self.call(duplicate_conflict, body)
+        if conflict is not None:
+            return reply(json_fragment(conflict) + '\n', 409)
+
+        try:
+            row = validate_question(body)
+        except ValueError:
+            abort(422)
+
+        if await self.call(category_cache.get, row['category']) is None:
+            abort(422)
+
+        question_id = await self.database.insert(
+            'INSERT INTO questions (question, answer, category, difficulty) '
+            'VALUES (?, ?, ?, ?)',
+            row['question'], row['answer'], row['category'],
+            row['difficulty'])
+        # keeps the counters, pools and indexes in step, as
+        # Question.insert() does
+        await self.call(
+            notify_question_change, 'insert',
+            detached_question(dict(row, id=question_id)))
+
+        return reply(json_fragment({'success': True}) + '\n')
+
+    async def count_questions(self, where, params):
+        rows = await self.database.fetch(
+            'SELECT count(*) FROM questions WHERE ' + where, *params)
+        return rows[0][0]
+
+    async def search_questions(self, request, search_string):
+        fields = requested_fields(request)
+        questions_limit = page_limit(request)
+        if not search_string:
+            current_questions, _ = await self.paginate_questions(
+                request, fields=fields)
+            total_questions = await self.call(question_counts.total)
+        else:
+            selected_page = request.args.get('page', 1, type=int)
+            search_filter = self.database.search_filter
+            pattern = like_pattern(search_string)
+
+            total_questions = await self.count_questions(
+                search_filter, (pattern,))
+
+            columns, sql = select_questions(fields)
+            sql += ' WHERE ' + search_filter + ' ORDER BY id LIMIT ? OFFSET ?'
+            params = [
+                pattern,
+                questions_limit,
+                max(0, (selected_page - 1) * questions_limit)
+            ]
+            rows = await self.database.fetch(sql, *params)
+            current_questions = [
+                json_fragment(dict(zip(columns, row))) for row in rows
+            ]
+
+        return reply(json_page({
+            'success': True,
+            'totalQuestions': total_questions,
+            'currentCategory': None
+        }, current_questions))
+
+
+app = TriviaASGI()
@@ -0,0 +1,208 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from models import Category, on_question_change, question_counts
+
+CATEGORIES_MAX_AGE = int(os.getenv('CATEGORIES_MAX_AGE', 300))
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 512))
+RESPONSE_CACHE_MAX_AGE = int(os.getenv('RESPONSE_CACHE_MAX_AGE', 300))
+
+# ----------------------------------------------------------------------------#
+# Category cache
+# ----------------------------------------------------------------------------#
+
+
+class CategoryCache:
+    """ Process-level copy of the categories table.
+
+        Categories almost never change, so they are loaded once and served
+        from memory, and reloaded every CATEGORIES_MAX_AGE seconds or after
+        invalidate(). Their version is a digest of the rows, so it is the
+        same in every worker serving the same categories.
+    """
+
+    def __init__(self, max_age=CATEGORIES_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._categories = None
+        self._digest = None
+        self._loaded_at = 0
+
+    def reload(self):
+        categories = [
+            (category.id, category.type)
+            for category in Category.query.order_by(Category.id).all()
+        ]
+        digest = hashlib.sha1(repr(categories).encode('utf-8')).hexdigest()
+
+        with self._lock:
+            self._digest = digest
+            self._categories = categories
+            self._loaded_at = time.time()
+
+        return categories
+
+    def invalidate(self):
+        """ Drop the cached categories after they were changed. """
+        with self._lock:
+            self._categories = None
+            self._digest = None
+
+    def all(self):
+        """ List of (id, type) pairs, ordered by id. """
+        categories = self._categories
+        if categories is None or \
+                time.time() - self._loaded_at > self.max_age:
+            categories = self.reload()
+        return categories
+
+    def as_dict(self):
+        return {
+            category_id: category_type
+            for category_id, category_type in self.all()
+        }
+
+    def get(self, category_id):
+        """ Type of the given category, or None if it does not exist. """
+        for current_id, category_type in self.all():
+            if current_id == category_id:
+                return category_type
+        return None
+
+    def etag_version(self):
+        """ Version of the content as it would be served right now. """
+        self.all()
+        return self._digest
+
+
+category_cache = CategoryCache()
+
+# ----------------------------------------------------------------------------#
+# Question versions
+# ----------------------------------------------------------------------------#
+
+
+def fold(digest, change):
+    """ Digest of a sequence of changes, extended by one change. """
+    return hashlib.sha1(
+        '{}{}'.format(digest, change).encode('utf-8')).hexdigest()
+
+
+class Generations:
+    """ Versions of the questions, globally and per category, so anything
+        derived from the questions can tell whether it is still current
+        without asking the database.
+
+        A version pairs the table versions of question_counts, which its
+        periodic rebuild reseeds from the database, with digests of the
+        changes this process made itself. The digests are not shared, so
+        workers, and a restarted worker, can hold different versions of
+        the same content. Writes from other processes only change the
+        versions once question_counts is rebuilt, within COUNTS_MAX_AGE
+        seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._epoch = ''
+        self._total = ''
+        self._categories = {}
+
+    def on_change(self, action, question):
+        if question is None:
+            # a reset says nothing about what changed
+            change = (action, uuid.uuid4().hex)
+        else:
+            change = (action, sorted(question.format().items()))
+
+        with self._lock:
+            self._total = fold(self._total, change)
+            if action not in ('insert', 'delete'):
+                # an update may have moved a question between categories
+                self._epoch = fold(self._epoch, change)
+                self._categories = {}
+            else:
+                key = int(question.category)
+                self._categories[key] = fold(
+                    self._categories.get(key, ''), change)
+
+    def total(self):
+        return (question_counts.version(), self._epoch, self._total)
+
+    def category(self, category):
+        return (
+            question_counts.version(category),
+            self._epoch,
+            self._categories.get(int(category), '')
+        )
+
+
+generations = Generations()
+on_question_change(generations.on_change)
+
+# ----------------------------------------------------------------------------#
+# Response cache
+# ----------------------------------------------------------------------------#
+
+
+class ResponseCache:
+    """ Bounded LRU cache of rendered list pages.
+
+        Each entry remembers the version it was rendered at (the page's
+        ETag, which folds in the write generations). A lookup with a newer
+        version is a miss, so question changes invalidate exactly the
+        pages of the categories they touch without scanning the cache.
+        Entries older than max_age seconds are misses as well, which bounds
+        the staleness of changes the versions can't see.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE,
+                 max_age=RESPONSE_CACHE_MAX_AGE):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or \
+                    time.time() - entry[2] > self.max_age:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, body):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, body, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+response_cache = ResponseCache()
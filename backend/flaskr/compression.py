@@ -0,0 +1,64 @@
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# responses smaller than this are sent as they are
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+# fast settings: responses are compressed on every request
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+# ----------------------------------------------------------------------------#
+# Response compression
+# ----------------------------------------------------------------------------#
+
+
+def negotiate_encoding(accept_encodings):
+    """ The content coding to use for a request's Accept-Encoding, or None.
+        The coding with the highest q-value wins; brotli, when the brotli
+        package is installed, wins ties.
+    """
+    codings = ('br', 'gzip') if brotli is not None else ('gzip',)
+    # max() keeps the first of equal values, so ties go by preference
+    coding = max(codings, key=lambda coding: accept_encodings[coding])
+    if accept_encodings[coding] > 0:
+        return coding
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(request, response, min_size=COMPRESS_MIN_SIZE):
+    """ Compress a response body in place when the client accepts it.
+
+        Only complete 200 responses of a text or JSON type are compressed,
+        and only from min_size bytes on. The ETag of a compressed response
+        is made weak: the bytes differ from the uncompressed representation,
+        and conditional requests compare ETags weakly.
+    """
+    if response.status_code != 200 or response.direct_passthrough or \
+            response.is_streamed or 'Content-Encoding' in response.headers or \
+            not response.mimetype.startswith(COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None or len(response.get_data()) < min_size:
+        return response
+
+    etag, weak = response.get_etag()
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
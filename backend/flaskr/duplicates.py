@@ -0,0 +1,338 @@
+import functools
+import hashlib
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import deque
+
+from flask import current_app
+
+from models import db, Question, on_question_change
+from .answers import normalize_answer
+
+# estimated share of common shingles above which questions are duplicates
+DUPLICATE_SIMILARITY = float(os.getenv('DUPLICATE_SIMILARITY', 0.8))
+DUPLICATES_MAX_AGE = int(os.getenv('DUPLICATES_MAX_AGE', 300))
+# earlier lines of the same import file that new lines are checked against
+IMPORT_DUPLICATE_WINDOW = int(os.getenv('IMPORT_DUPLICATE_WINDOW', 10000))
+SHINGLE_SIZE = 3
+# 8 bands of 4 rows: pairs from about 0.6 similarity on become candidates,
+# pairs at 0.8 almost always do
+MINHASH_BANDS = 8
+MINHASH_ROWS = 4
+MINHASH_SIZE = MINHASH_BANDS * MINHASH_ROWS
+SHINGLE_HASHES = struct.Struct('<{}I'.format(MINHASH_SIZE))
+
+# ----------------------------------------------------------------------------#
+# MinHash signatures
+# ----------------------------------------------------------------------------#
+
+
+def shingles(normalized):
+    """ Character shingles of a normalized text. """
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized}
+    return {
+        normalized[i:i + SHINGLE_SIZE]
+        for i in range(len(normalized) - SHINGLE_SIZE + 1)
+    }
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def shingle_hashes(shingle):
+    """ MINHASH_SIZE independent 32-bit hashes of one shingle. Shingles
+        repeat a lot across questions, so they are memoized.
+    """
+    return SHINGLE_HASHES.unpack(
+        hashlib.shake_128(shingle.encode('utf-8')).digest(
+            SHINGLE_HASHES.size))
+
+
+def minhash(normalized):
+    """ MinHash signature of a normalized text, as an array of uint32. """
+    hashes = map(shingle_hashes, shingles(normalized))
+
+    return array('I', map(min, zip(*hashes)))
+
+
+def similarity(signature, other):
+    """ Estimated Jaccard similarity of the shingles of two texts. """
+    return sum(
+        1 for first, second in zip(signature, other) if first == second
+    ) / MINHASH_SIZE
+
+
+def band_keys(signature):
+    return [
+        hash((band, signature[start:start + MINHASH_ROWS].tobytes()))
+        for band, start in enumerate(range(0, MINHASH_SIZE, MINHASH_ROWS))
+    ]
+
+# ----------------------------------------------------------------------------#
+# Duplicate index
+# ----------------------------------------------------------------------------#
+
+
+class DuplicateIndex:
+    """ Exact and near duplicates of question texts, found without
+        comparing against every question.
+
+        Texts are normalized like answers. Identical normalized texts are
+        found through a dict; near ones through locality-sensitive hashing
+        of MinHash signatures: questions sharing a band of their signature
+        are candidates, and candidates are kept when their estimated
+        similarity reaches DUPLICATE_SIMILARITY. The index is kept in step
+        with question changes and reloaded every DUPLICATES_MAX_AGE
+        seconds.
+
+        Only the first load happens in a request (or in warm_up()). Later
+        reloads run in a background thread while checks keep using the
+        current index, and the new one is swapped in when complete, with
+        the changes made in the meantime replayed onto it.
+    """
+
+    def __init__(self, max_age=DUPLICATES_MAX_AGE,
+                 threshold=DUPLICATE_SIMILARITY):
+        self.max_age = max_age
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # held for a whole rebuild, so only one runs at a time
+        self._rebuild_lock = threading.Lock()
+        self._entries = None
+        self._exact = {}
+        self._bands = {}
+        self._changes = None
+        self._loaded_at = 0
+
+    def rebuild(self):
+        with self._rebuild_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        with self._lock:
+            self._changes = []
+        try:
+            fresh = DuplicateIndex(self.max_age, self.threshold)
+            fresh.load(db.session.query(
+                Question.id, Question.question).yield_per(10000))
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+
+        with self._lock:
+            loaded_at = time.time()
+            for change in self._changes:
+                if change[0] == 'reset':
+                    loaded_at = 0
+                    continue
+                fresh._remove(change[1])
+                if change[0] == 'add':
+                    fresh._add(change[1], change[2])
+            self._entries = fresh._entries
+            self._exact = fresh._exact
+            self._bands = fresh._bands
+            self._changes = None
+            self._loaded_at = loaded_at
+
+    def load(self, rows):
+        """ Replace the index with the given (key, text) rows. """
+        with self._lock:
+            self._entries = {}
+            self._exact = {}
+            self._bands = {}
+            for key, text in rows:
+                self._add(key, text)
+            self._loaded_at = time.time()
+
+    def invalidate(self):
+        """ Have the index reloaded in the background on the next check.
+        """
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(('reset',))
+            self._loaded_at = 0
+
+    def _ensure_loaded(self):
+        if self._entries is None:
+            with self._rebuild_lock:
+                if self._entries is None:
+                    self._rebuild()
+        elif time.time() - self._loaded_at > self.max_age:
+            self._rebuild_in_background()
+
+    def _rebuild_in_background(self):
+        if not self._rebuild_lock.acquire(blocking=False):
+            return
+        app = current_app._get_current_object()
+
+        def run():
+            try:
+                with app.app_context():
+                    try:
+                        self._rebuild()
+                    finally:
+                        db.session.remove()
+            except Exception:
+                app.logger.exception('Failed to reload the duplicate index')
+            finally:
+                self._rebuild_lock.release()
+
+        threading.Thread(
+            target=run, name='duplicate-index', daemon=True).start()
+
+    def _add(self, key, text):
+        normalized = normalize_answer(text)
+        signature = minhash(normalized)
+        bands = band_keys(signature)
+        self._entries[key] = (normalized, signature, bands)
+        self._exact.setdefault(normalized, []).append(key)
+        for band in bands:
+            # most bands hold a single question, stored without a list
+            current = self._bands.get(band)
+            if current is None:
+                self._bands[band] = key
+            elif isinstance(current, list):
+                current.append(key)
+            else:
+                self._bands[band] = [current, key]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        normalized, _, bands = entry
+        self._exact[normalized].remove(key)
+        if not self._exact[normalized]:
+            del self._exact[normalized]
+        for band in bands:
+            current = self._bands[band]
+            if isinstance(current, list):
+                current.remove(key)
+                if len(current) == 1:
+                    self._bands[band] = current[0]
+            else:
+                del self._bands[band]
+
+    def add(self, key, text):
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(('add', key, text))
+            if self._entries is not None:
+                self._remove(key)
+                self._add(key, text)
+
+    def remove(self, key):
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(('remove', key))
+            if self._entries is not None:
+                self._remove(key)
+
+    def on_change(self, action, question):
+        if action in ('insert', 'update'):
+            self.add(question.id, question.question)
+        elif action == 'delete':
+            self.remove(question.id)
+        else:
+            self.invalidate()
+
+    def find(self, text):
+        """ [(key, similarity)] of the duplicates of `text`, most similar
+            first; exact matches of the normalized text have similarity 1.
+        """
+        self._ensure_loaded()
+
+        normalized = normalize_answer(text)
+        signature = minhash(normalized)
+        with self._lock:
+            matches = {key: 1.0 for key in self._exact.get(normalized, ())}
+            for band in band_keys(signature):
+                current = self._bands.get(band)
+                if current is None:
+                    continue
+                for key in current if isinstance(current, list) \
+                        else (current,):
+                    if key in matches:
+                        continue
+                    score = similarity(signature, self._entries[key][1])
+                    if score >= self.threshold:
+                        matches[key] = score
+
+        return sorted(
+            matches.items(), key=lambda match: (-match[1], match[0]))
+
+
+duplicate_index = DuplicateIndex()
+on_question_change(duplicate_index.on_change)
+
+
+class DuplicateCheck:
+    """ Checks the questions of one batch against the index and against
+        the questions checked before them in the same batch, which are not
+        in the index yet. With a `window`, only the last `window` of those
+        are remembered, which bounds the memory of long imports.
+    """
+
+    def __init__(self, index=duplicate_index, label='item', window=None):
+        self.index = index
+        self.label = label
+        self.window = window
+        self.pending = DuplicateIndex(
+            max_age=float('inf'), threshold=index.threshold)
+        self.pending.load([])
+        self._recent = deque()
+
+    def check(self, key, text):
+        """ Raise ValueError naming the closest duplicate of `text`, or
+            remember it under `key` for the rest of the batch.
+        """
+        existing = self.index.find(text)
+        if existing:
+            raise ValueError(
+                'duplicate of question {}'.format(existing[0][0]))
+
+        earlier = self.pending.find(text)
+        if earlier:
+            raise ValueError(
+                'duplicate of {} {}'.format(self.label, earlier[0][0]))
+
+        self.pending.add(key, text)
+        if self.window is not None:
+            self._recent.append(key)
+            if len(self._recent) > self.window:
+                self.pending.remove(self._recent.popleft())
+
+
+def duplicate_groups(threshold=DUPLICATE_SIMILARITY):
+    """ Groups of ids of duplicate questions in the table, built in one
+        pass: each question is matched against the ones before it and
+        then added.
+    """
+    index = DuplicateIndex(max_age=float('inf'), threshold=threshold)
+    index.load([])
+    parents = {}
+
+    def root(question_id):
+        while parents[question_id] != question_id:
+            parents[question_id] = parents[parents[question_id]]
+            question_id = parents[question_id]
+        return question_id
+
+    rows = db.session.query(Question.id, Question.question).order_by(
+        Question.id).yield_per(10000)
+    for question_id, text in rows:
+        parents[question_id] = question_id
+        for match_id, _ in index.find(text):
+            parents[root(question_id)] = root(match_id)
+        index.add(question_id, text)
+
+    groups = {}
+    for question_id in parents:
+        groups.setdefault(root(question_id), []).append(question_id)
+
+    return sorted(
+        (sorted(ids) for ids in groups.values() if len(ids) > 1),
+        key=lambda ids: ids[0])
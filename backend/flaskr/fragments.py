@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+
+from models import db, Question, on_question_change
+
+FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', 100000))
+QUESTION_COLUMNS = (
+    Question.id,
+    Question.question,
+    Question.answer,
+    Question.category,
+    Question.difficulty
+)
+# question fields a client can narrow list responses to
+QUESTION_FIELDS = tuple(column.key for column in QUESTION_COLUMNS)
+
+# ----------------------------------------------------------------------------#
+# Pre-serialized question JSON
+# ----------------------------------------------------------------------------#
+
+
+def json_fragment(item):
+    """ Serialize a dict exactly the way jsonify does. """
+    return json.dumps(item, sort_keys=True, separators=(',', ':'))
+
+
+class FragmentCache:
+    """ The JSON of each question, serialized once and reused by every
+        page that lists it. Entries are dropped when their question is
+        updated or deleted. At most max_entries questions are kept; past
+        that, new fragments are simply not cached.
+    """
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._fragments = {}
+
+    def get_many(self, question_ids):
+        fragments = self._fragments
+        return {
+            question_id: fragments[question_id]
+            for question_id in question_ids if question_id in fragments
+        }
+
+    def put(self, question_id, fragment):
+        with self._lock:
+            if len(self._fragments) < self.max_entries:
+                self._fragments[question_id] = fragment
+
+    def on_change(self, action, question):
+        with self._lock:
+            if action in ('update', 'delete'):
+                self._fragments.pop(question.id, None)
+            elif action == 'reset':
+                self._fragments.clear()
+
+
+fragment_cache = FragmentCache()
+on_question_change(fragment_cache.on_change)
+
+
+def load_fragments(question_ids):
+    """ JSON fragments of the given questions, in order.
+
+        Only the questions missing from the cache are read, as plain column
+        tuples, without building ORM objects.
+    """
+    fragments = fragment_cache.get_many(question_ids)
+    missing_ids = [
+        question_id for question_id in question_ids
+        if question_id not in fragments
+    ]
+
+    if missing_ids:
+        rows = db.session.query(*QUESTION_COLUMNS).filter(
+            Question.id.in_(missing_ids)
+        )
+        for row in rows:
+            fragment = json_fragment(row._asdict())
+            fragment_cache.put(row.id, fragment)
+            fragments[row.id] = fragment
+
+    return [
+        fragments[question_id]
+        for question_id in question_ids if question_id in fragments
+    ]
+
+
+def json_page(payload, fragments, key='questions'):
+    """ Serialize `payload` with a list of pre-serialized fragments spliced
+        in under `key`, without decoding them again.
+    """
+    body = '"{}":[{}]'.format(key, ','.join(fragments))
+    if payload:
+        body += ',' + json_fragment(payload)[1:-1]
+
+    return '{' + body + '}\n'
+
+
+def narrow_fragments(fragments, fields):
+    """ Re-serialize fragments with only the given fields. """
+    return [
+        json_fragment({
+            name: value for name, value in json.loads(fragment).items()
+            if name in fields
+        }) for fragment in fragments
+    ]
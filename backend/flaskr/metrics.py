@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0
+)
+
+# ----------------------------------------------------------------------------#
+# SQL timing
+# ----------------------------------------------------------------------------#
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if has_request_context() and 'sql_queries' in g:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    if has_request_context() and 'sql_queries' in g:
+        starts = conn.info.get('query_start')
+        if not starts:
+            return
+        g.sql_queries += 1
+        g.sql_time += time.perf_counter() - starts.pop()
+
+
+def listen_to_queries():
+    """ Time every statement run by any engine, primary or replica. """
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+# ----------------------------------------------------------------------------#
+# Route metrics
+# ----------------------------------------------------------------------------#
+
+
+class RouteMetrics:
+    """ Per-route request counts, latency histograms and SQL totals. """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, method, route, status, duration, queries, sql_time):
+        with self._lock:
+            metrics = self._routes.get((method, route, status))
+            if metrics is None:
+                metrics = self._routes[(method, route, status)] = {
+                    'buckets': [0] * len(self.buckets),
+                    'count': 0,
+                    'sum': 0.0,
+                    'queries': 0,
+                    'sql_time': 0.0
+                }
+            for index, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    metrics['buckets'][index] += 1
+            metrics['count'] += 1
+            metrics['sum'] += duration
+            metrics['queries'] += queries
+            metrics['sql_time'] += sql_time
+
+    def render(self):
+        """ Render the metrics in the Prometheus text exposition format. """
+        lines = [
+            '# HELP trivia_request_duration_seconds Request latency.',
+            '# TYPE trivia_request_duration_seconds histogram'
+        ]
+        with self._lock:
+            routes = sorted(self._routes.items())
+            for (method, route, status), metrics in routes:
+                labels = 'method="{}",route="{}",status="{}"'.format(
+                    method, route, status)
+                for bound, count in zip(self.buckets, metrics['buckets']):
+                    lines.append(
+                        'trivia_request_duration_seconds_bucket'
+                        '{{{},le="{}"}} {}'.format(labels, bound, count))
+                lines.append(
+                    'trivia_request_duration_seconds_bucket'
+                    '{{{},le="+Inf"}} {}'.format(labels, metrics['count']))
+                lines.append('trivia_request_duration_seconds_sum{{{}}} {}'
+                             .format(labels, metrics['sum']))
+                lines.append('trivia_request_duration_seconds_count{{{}}} {}'
+                             .format(labels, metrics['count']))
+
+            lines.append('# HELP trivia_sql_queries_total SQL statements run.')
+            lines.append('# TYPE trivia_sql_queries_total counter')
+            for (method, route, status), metrics in routes:
+                lines.append(
+                    'trivia_sql_queries_total'
+                    '{{method="{}",route="{}",status="{}"}} {}'.format(
+                        method, route, status, metrics['queries']))
+
+            lines.append(
+                '# HELP trivia_sql_duration_seconds_total Time spent in SQL.')
+            lines.append('# TYPE trivia_sql_duration_seconds_total counter')
+            for (method, route, status), metrics in routes:
+                lines.append(
+                    'trivia_sql_duration_seconds_total'
+                    '{{method="{}",route="{}",status="{}"}} {}'.format(
+                        method, route, status, metrics['sql_time']))
+
+        return '\n'.join(lines) + '\n'
+
+
+route_metrics = RouteMetrics()
+
+# ----------------------------------------------------------------------------#
+# Flask integration
+# ----------------------------------------------------------------------------#
+
+
+def init_metrics(app):
+    """ Instrument every request of the app and serve /metrics.
+
+        Only called when METRICS_ENABLED is set, so a disabled app pays
+        nothing beyond one dictionary lookup per SQL statement.
+    """
+    listen_to_queries()
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_time = 0.0
+
+    @app.after_request
+    def record_timing(response):
+        if 'request_start' not in g:
+            return response
+
+        duration = time.perf_counter() - g.request_start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        route_metrics.observe(
+            request.method, route, response.status_code,
+            duration, g.sql_queries, g.sql_time
+        )
+        response.headers.add(
+            'Server-Timing',
+            'db;desc="{} queries";dur={:.2f}, app;dur={:.2f}'.format(
+                g.sql_queries, g.sql_time * 1000, duration * 1000)
+        )
+        return response
+
+    @app.route('/metrics')
+    def get_metrics():
+        """ Get the request metrics in Prometheus format. """
+        return Response(
+            route_metrics.render(),
+            mimetype='text/plain; version=0.0.4'
+        )
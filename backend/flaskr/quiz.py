@@ -0,0 +1,450 @@
+import base64
+import math
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from array import array
+
+from itsdangerous import BadSignature, Signer
+
+from models import db, Question, on_question_change, primary_reads
+
+QUIZ_POOLS_MAX_AGE = int(os.getenv('QUIZ_POOLS_MAX_AGE', 300))
+# random probes before falling back to listing the unused ids
+MAX_DRAW_ATTEMPTS = 16
+# question ids below this are recorded in the quiz state's bitset,
+# bounding its decoded size
+MAX_QUIZ_STATE_ID = 2 ** 24
+# higher ids are listed one by one, up to this many per quiz
+MAX_QUIZ_STATE_HIGH_IDS = 4096
+# difficulty range of adaptive quizzes, and how sharply they stick to
+# the target difficulty
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+DIFFICULTY_SPREAD = 1.0
+
+# ----------------------------------------------------------------------------#
+# Quiz pools: per-category and per-difficulty question ids for draws
+# ----------------------------------------------------------------------------#
+
+
+def sample_unused(ids, excluded, rng=random):
+    """ Pick a random id from `ids` that is not in `excluded`.
+
+        Random probes cost O(1) each and almost always succeed; only when
+        nearly the whole pool has been asked do we list what is left.
+    """
+    if len(ids) == 0:
+        return None
+
+    for _ in range(MAX_DRAW_ATTEMPTS):
+        question_id = ids[rng.randrange(len(ids))]
+        if question_id not in excluded:
+            return question_id
+
+    remaining = [
+        question_id for question_id in ids if question_id not in excluded
+    ]
+    if not remaining:
+        return None
+
+    return rng.choice(remaining)
+
+
+class FenwickTree:
+    """ Prefix sums over a growable list of counts, so an index can be
+        picked with probability proportional to its count, and a count
+        changed, in O(log n).
+    """
+
+    def __init__(self):
+        self._tree = [0]
+
+    def __len__(self):
+        return len(self._tree) - 1
+
+    def prefix_sum(self, end):
+        """ Sum of the counts before `end`. """
+        total = 0
+        while end > 0:
+            total += self._tree[end]
+            end &= end - 1
+        return total
+
+    def total(self):
+        return self.prefix_sum(len(self))
+
+    def append(self, count=0):
+        position = len(self._tree)
+        covered_from = position - (position & -position)
+        self._tree.append(
+            count + self.prefix_sum(position - 1) -
+            self.prefix_sum(covered_from))
+
+    def add(self, index, delta):
+        position = index + 1
+        while position < len(self._tree):
+            self._tree[position] += delta
+            position += position & -position
+
+    def find(self, value):
+        """ Index whose count range contains `value`, for a value in
+            [0, total()).
+        """
+        position = 0
+        step = 1 << len(self).bit_length()
+        while step:
+            following = position + step
+            if following <= len(self) and self._tree[following] <= value:
+                position = following
+                value -= self._tree[following]
+            step >>= 1
+        return position
+
+
+class DifficultyTier:
+    """ The buckets of one difficulty across categories, with a Fenwick
+        tree over their sizes to pick a category weighted by its bucket.
+    """
+
+    def __init__(self):
+        self.categories = []
+        self.positions = {}
+        self.sizes = FenwickTree()
+
+    def resize(self, category, delta):
+        position = self.positions.get(category)
+        if position is None:
+            position = self.positions[category] = len(self.categories)
+            self.categories.append(category)
+            self.sizes.append()
+        self.sizes.add(position, delta)
+
+
+def difficulty_weight(difficulty, target_difficulty):
+    """ Preference for a difficulty, falling off around the target. """
+    return math.exp(
+        -(difficulty - target_difficulty) ** 2 / (2 * DIFFICULTY_SPREAD ** 2))
+
+
+def adaptive_target(num_correct, num_answered):
+    """ Difficulty to aim for after num_correct of num_answered answers
+        were right: 3 for a new player, towards 5 for a strong one and
+        towards 1 for a struggling one.
+    """
+    accuracy = (num_correct + 1) / (num_answered + 2)
+
+    return MIN_DIFFICULTY + accuracy * (MAX_DIFFICULTY - MIN_DIFFICULTY)
+
+
+def pick_weighted(weights, rng=random):
+    """ Key of `weights` picked with probability proportional to its
+        value.
+    """
+    value = rng.random() * sum(weights.values())
+    for key, weight in weights.items():
+        if value < weight:
+            return key
+        value -= weight
+    return key
+
+
+class QuizPools:
+    """ Compact arrays of question ids, one per (category, difficulty).
+
+        The arrays are loaded once with an id/category/difficulty
+        projection and kept in step with Question.insert() and
+        Question.delete(). A draw first picks a difficulty, then a
+        question of that difficulty: for the "ALL" quiz a Fenwick tree per
+        difficulty picks the category in O(log categories), so drawing
+        never walks the question bank. Drawing only needs the ids, so the
+        quiz endpoint fetches a single row per request. The bucket and
+        position of every id are kept too, so a question is removed in
+        O(1) by swapping the last id of its bucket into its place.
+    """
+
+    def __init__(self, max_age=QUIZ_POOLS_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._buckets = None
+        self._tiers = None
+        self._positions = None
+        self._loaded_at = 0
+
+    def rebuild(self):
+        """ Reload every pool from the database. """
+        self.load(db.session.query(
+            Question.id, Question.category, Question.difficulty))
+
+    def load(self, rows):
+        """ Replace every pool with the given (id, category, difficulty)
+            rows.
+        """
+        buckets = {}
+        positions = {}
+        for question_id, category, difficulty in rows:
+            ids = buckets.setdefault((category, difficulty), array('l'))
+            positions[question_id] = ((category, difficulty), len(ids))
+            ids.append(question_id)
+
+        tiers = {}
+        for (category, difficulty), ids in sorted(buckets.items()):
+            tiers.setdefault(difficulty, DifficultyTier()).resize(
+                category, len(ids))
+
+        with self._lock:
+            self._buckets = buckets
+            self._tiers = tiers
+            self._positions = positions
+            self._loaded_at = time.time()
+
+    def invalidate(self):
+        with self._lock:
+            self._buckets = None
+
+    def _ensure_loaded(self):
+        if self._buckets is None or \
+                time.time() - self._loaded_at > self.max_age:
+            self.rebuild()
+
+    def add(self, question_id, category, difficulty):
+        with self._lock:
+            if self._buckets is None:
+                return
+            if question_id in self._positions:
+                return
+            category, difficulty = int(category), int(difficulty)
+            ids = self._buckets.setdefault(
+                (category, difficulty), array('l'))
+            self._positions[question_id] = ((category, difficulty), len(ids))
+            ids.append(question_id)
+            self._tiers.setdefault(difficulty, DifficultyTier()).resize(
+                category, 1)
+
+    def discard(self, question_id):
+        with self._lock:
+            if self._buckets is None:
+                return
+            located = self._positions.pop(question_id, None)
+            if located is None:
+                return
+            (category, difficulty), position = located
+            ids = self._buckets[(category, difficulty)]
+            # swap with the last id so removal does not shift the array
+            last_id = ids.pop()
+            if last_id != question_id:
+                ids[position] = last_id
+                self._positions[last_id] = ((category, difficulty), position)
+            self._tiers[difficulty].resize(category, -1)
+
+    def on_change(self, action, question):
+        if action == 'insert':
+            self.add(question.id, question.category, question.difficulty)
+        elif action == 'delete':
+            self.discard(question.id)
+        else:
+            self.invalidate()
+
+    def _tier_size(self, category, difficulty):
+        if category:
+            return len(self._buckets.get((category, difficulty), ()))
+        return self._tiers[difficulty].sizes.total()
+
+    def _draw_from_tier(self, category, difficulty, excluded, rng):
+        if category:
+            return sample_unused(
+                self._buckets.get((category, difficulty), array('l')),
+                excluded, rng)
+
+        tier = self._tiers[difficulty]
+        exhausted = set()
+        for _ in range(MAX_DRAW_ATTEMPTS):
+            position = tier.sizes.find(rng.randrange(tier.sizes.total()))
+            current = tier.categories[position]
+            if current in exhausted:
+                continue
+            question_id = sample_unused(
+                self._buckets[(current, difficulty)], excluded, rng)
+            if question_id is not None:
+                return question_id
+            exhausted.add(current)
+
+        # nearly everything of this difficulty was asked: weigh what is
+        # left directly
+        remaining = {
+            current: len(self._buckets[(current, difficulty)])
+            for current in tier.categories
+            if current not in exhausted and
+            len(self._buckets[(current, difficulty)])
+        }
+        while remaining:
+            current = pick_weighted(remaining, rng)
+            question_id = sample_unused(
+                self._buckets[(current, difficulty)], excluded, rng)
+            if question_id is not None:
+                return question_id
+            del remaining[current]
+
+        return None
+
+    def draw(self, category, excluded=(), target_difficulty=None,
+             rng=random):
+        """ Draw an id not in `excluded` from the given category, or from
+            every category when category is falsy (the "ALL" quiz).
+
+            Without a target the draw is uniform over the questions. With
+            one, a difficulty is picked by its closeness to the target
+            and the question uniformly among those of that difficulty.
+        """
+        category = int(category) if category else None
+        while True:
+            self._ensure_loaded()
+            with self._lock:
+                # invalidate() may have dropped the pools since
+                if self._buckets is not None:
+                    return self._draw_loaded(
+                        category, excluded, target_difficulty, rng)
+
+    def _draw_loaded(self, category, excluded, target_difficulty, rng):
+        """ draw() on loaded pools, with self._lock held. """
+        weights = {}
+        for difficulty in self._tiers:
+            size = self._tier_size(category, difficulty)
+            if size == 0:
+                continue
+            weights[difficulty] = size if target_difficulty is None \
+                else difficulty_weight(difficulty, target_difficulty)
+
+        while weights:
+            difficulty = pick_weighted(weights, rng)
+            question_id = self._draw_from_tier(
+                category, difficulty, excluded, rng)
+            if question_id is not None:
+                return question_id
+            del weights[difficulty]
+
+        return None
+
+
+quiz_pools = QuizPools()
+on_question_change(quiz_pools.on_change)
+
+
+def draw_question(category, excluded=(), target_difficulty=None):
+    """ Fetch a random unused question of the category, one row at most
+        per draw, preferring questions close to target_difficulty if it is
+        given. Returns None when every question has been asked.
+    """
+    if not isinstance(excluded, (set, AskedQuestions)):
+        excluded = set(excluded)
+
+    while True:
+        question_id = quiz_pools.draw(category, excluded, target_difficulty)
+        if question_id is None:
+            return None
+
+        question = Question.query.get(question_id)
+        if question is None:
+            # a lagging replica may not have it yet
+            with primary_reads():
+                question = Question.query.get(question_id)
+        if question is not None:
+            return question
+
+        # deleted by another worker since the pools were loaded
+        quiz_pools.discard(question_id)
+        excluded.add(question_id)
+
+# ----------------------------------------------------------------------------#
+# Quiz state tokens
+# ----------------------------------------------------------------------------#
+
+
+class AskedQuestions:
+    """ Set of asked question ids kept as a bitset, one bit per id.
+
+        Ids from MAX_QUIZ_STATE_ID on would make the bitset too large and
+        are kept in a plain set instead, up to MAX_QUIZ_STATE_HIGH_IDS.
+    """
+
+    def __init__(self, bits=b'', high_ids=()):
+        self.bits = bytearray(bits)
+        self.high_ids = set(high_ids)
+
+    def __contains__(self, question_id):
+        if question_id >= MAX_QUIZ_STATE_ID:
+            return question_id in self.high_ids
+        index = question_id >> 3
+        return index < len(self.bits) and \
+            bool(self.bits[index] >> (question_id & 7) & 1)
+
+    def add(self, question_id):
+        if question_id < 0:
+            raise ValueError('question id out of range')
+        if question_id >= MAX_QUIZ_STATE_ID:
+            if question_id not in self.high_ids and \
+                    len(self.high_ids) >= MAX_QUIZ_STATE_HIGH_IDS:
+                raise ValueError('quiz state too large')
+            self.high_ids.add(question_id)
+            return
+        index = question_id >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index + 1 - len(self.bits)))
+        self.bits[index] |= 1 << (question_id & 7)
+
+    def update(self, question_ids):
+        for question_id in question_ids:
+            self.add(question_id)
+
+
+def quiz_state_signer(secret_key):
+    return Signer(secret_key, salt='quiz-state')
+
+
+def encode_quiz_state(asked, secret_key):
+    """ Signed, compressed token of the asked questions: the bitset, then
+        the high ids as little-endian uint64s if there are any.
+    """
+    payload = base64.urlsafe_b64encode(zlib.compress(bytes(asked.bits), 9))
+    if asked.high_ids:
+        high_ids = sorted(asked.high_ids)
+        payload += b'.' + base64.urlsafe_b64encode(zlib.compress(
+            struct.pack('<{}Q'.format(len(high_ids)), *high_ids), 9))
+
+    return quiz_state_signer(secret_key).sign(payload).decode('ascii')
+
+
+def decompress_bounded(data, max_size):
+    decompressor = zlib.decompressobj()
+    value = decompressor.decompress(data, max_size)
+    if decompressor.unconsumed_tail:
+        raise ValueError('quiz state too large')
+    return value
+
+
+def decode_quiz_state(token, secret_key):
+    """ AskedQuestions from a token made by encode_quiz_state. An empty
+        token starts a new quiz. Raises ValueError for a tampered or
+        malformed token, or any token when there is no secret key.
+    """
+    if not token:
+        return AskedQuestions()
+    if secret_key is None:
+        raise ValueError('quiz state tokens are disabled')
+
+    try:
+        payload = quiz_state_signer(secret_key).unsign(token)
+        bits, _, high_ids = payload.partition(b'.')
+        bits = decompress_bounded(
+            base64.urlsafe_b64decode(bits), MAX_QUIZ_STATE_ID // 8)
+        high_ids = decompress_bounded(
+            base64.urlsafe_b64decode(high_ids), MAX_QUIZ_STATE_HIGH_IDS * 8)
+        high_ids = struct.unpack(
+            '<{}Q'.format(len(high_ids) // 8), high_ids)
+    except (BadSignature, TypeError, ValueError, struct.error, zlib.error):
+        raise ValueError('invalid quiz state')
+
+    return AskedQuestions(bits, high_ids)
@@ -0,0 +1,305 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left, insort
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from models import db, Score
+
+from .quiz import FenwickTree
+
+SCORE_FLUSH_BATCH = int(os.getenv('SCORE_FLUSH_BATCH', 500))
+SCORE_FLUSH_INTERVAL = float(os.getenv('SCORE_FLUSH_INTERVAL', 2))
+SCORE_QUEUE_SIZE = int(os.getenv('SCORE_QUEUE_SIZE', 10000))
+LEADERBOARD_MAX_AGE = int(os.getenv('LEADERBOARD_MAX_AGE', 300))
+MAX_PLAYER_LENGTH = 80
+# entries per block of a board; a block is split past twice as many
+BOARD_BLOCK_SIZE = 512
+
+# ----------------------------------------------------------------------------#
+# Ranked boards
+# ----------------------------------------------------------------------------#
+
+
+class Board:
+    """ Best score of each player, kept as sorted blocks of (-score,
+        player) entries. A submission bisects to its block and inserts
+        there, so it moves at most BOARD_BLOCK_SIZE entries instead of
+        the whole board; a Fenwick tree over the block sizes turns a
+        position within a block into a rank in O(log n).
+    """
+
+    def __init__(self):
+        self.best_scores = {}
+        self._blocks = []
+        # last entry of each block, to bisect to the block of an entry
+        self._maxes = []
+        self._sizes = FenwickTree()
+
+    def __len__(self):
+        return len(self.best_scores)
+
+    def _reindex(self):
+        """ Rebuild the block sizes after a block was split or removed. """
+        self._sizes = FenwickTree()
+        for block in self._blocks:
+            self._sizes.append(len(block))
+
+    def _insert(self, entry):
+        if not self._blocks:
+            self._blocks.append([entry])
+            self._maxes.append(entry)
+            self._sizes.append(1)
+            return
+
+        index = min(bisect_left(self._maxes, entry), len(self._blocks) - 1)
+        block = self._blocks[index]
+        insort(block, entry)
+        self._maxes[index] = block[-1]
+        self._sizes.add(index, 1)
+
+        if len(block) > 2 * BOARD_BLOCK_SIZE:
+            tail = block[BOARD_BLOCK_SIZE:]
+            del block[BOARD_BLOCK_SIZE:]
+            self._blocks.insert(index + 1, tail)
+            self._maxes[index:index + 1] = [block[-1], tail[-1]]
+            self._reindex()
+
+    def _remove(self, entry):
+        index = bisect_left(self._maxes, entry)
+        block = self._blocks[index]
+        del block[bisect_left(block, entry)]
+
+        if block:
+            self._maxes[index] = block[-1]
+            self._sizes.add(index, -1)
+        else:
+            del self._blocks[index]
+            del self._maxes[index]
+            self._reindex()
+
+    def submit(self, player, score):
+        """ Record a score; only a player's best score is ranked. """
+        best_score = self.best_scores.get(player)
+        if best_score is not None:
+            if score <= best_score:
+                return
+            self._remove((-best_score, player))
+        self.best_scores[player] = score
+        self._insert((-score, player))
+
+    def rank(self, player):
+        """ 1-based rank of the player, or None if they have no score. """
+        best_score = self.best_scores.get(player)
+        if best_score is None:
+            return None
+        entry = (-best_score, player)
+        index = bisect_left(self._maxes, entry)
+        return self._sizes.prefix_sum(index) + \
+            bisect_left(self._blocks[index], entry) + 1
+
+    def top(self, limit, offset=0):
+        players = []
+        if offset < len(self):
+            first = self._sizes.find(offset)
+            position = offset - self._sizes.prefix_sum(first)
+            for block in self._blocks[first:]:
+                players.extend(
+                    block[position:position + limit - len(players)])
+                position = 0
+                if len(players) == limit:
+                    break
+
+        return [
+            {'rank': offset + index + 1, 'player': player, 'score': -score}
+            for index, (score, player) in enumerate(players)
+        ]
+
+
+class Leaderboard:
+    """ In-memory boards, overall and per category, with write-behind.
+
+        Submissions update the boards immediately and are queued; a
+        background thread writes the queue to the scores table in batches,
+        every SCORE_FLUSH_INTERVAL seconds or as soon as SCORE_FLUSH_BATCH
+        scores are waiting, and once more when the process exits. Boards
+        are reloaded from the table every LEADERBOARD_MAX_AGE seconds to
+        pick up scores submitted to other workers.
+
+        At most SCORE_QUEUE_SIZE scores wait to be written; past that,
+        submit() raises queue.Full. While the database is unreachable the
+        queue is kept; when it rejects a batch, the scores are written one
+        by one and the rejected ones are dropped.
+    """
+
+    def __init__(self, max_age=LEADERBOARD_MAX_AGE,
+                 max_pending=SCORE_QUEUE_SIZE):
+        self.max_age = max_age
+        self.max_pending = max_pending
+        self.app = None
+        self._lock = threading.Lock()
+        self._boards = None
+        self._loaded_at = 0
+        self._pending = []
+        self._wake = threading.Event()
+        self._worker = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def reload(self):
+        rows = db.session.query(
+            Score.player, Score.category, func.max(Score.score)
+        ).group_by(Score.player, Score.category).all()
+
+        boards = {None: Board()}
+        for player, category, score in rows:
+            boards[None].submit(player, score)
+            if category is not None:
+                boards.setdefault(category, Board()).submit(player, score)
+
+        with self._lock:
+            # scores still waiting to be written are not in the table yet
+            for row in self._pending:
+                boards[None].submit(row['player'], row['score'])
+                if row['category'] is not None:
+                    boards.setdefault(row['category'], Board()).submit(
+                        row['player'], row['score'])
+            self._boards = boards
+            self._loaded_at = time.time()
+
+    def _ensure_loaded(self):
+        if self._boards is None or \
+                time.time() - self._loaded_at > self.max_age:
+            self.reload()
+
+    def submit(self, player, score, category=None):
+        """ Rank a score and queue it for writing. Returns the player's
+            best score and rank on the board of the category.
+        """
+        self._ensure_loaded()
+
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                raise queue.Full()
+            self._boards[None].submit(player, score)
+            if category is not None:
+                self._boards.setdefault(category, Board()).submit(
+                    player, score)
+            board = self._boards[category]
+            result = (board.best_scores[player], board.rank(player))
+
+            self._pending.append({
+                'player': player,
+                'score': score,
+                'category': category,
+                'created_at': int(time.time())
+            })
+            if len(self._pending) >= SCORE_FLUSH_BATCH:
+                self._wake.set()
+        self._start_worker()
+
+        return result
+
+    def top(self, category=None, limit=10, offset=0):
+        self._ensure_loaded()
+        with self._lock:
+            board = self._boards.get(category, Board())
+            return board.top(limit, offset), len(board)
+
+    def standing(self, player, category=None):
+        """ (best score, rank) of the player, or None. """
+        self._ensure_loaded()
+        with self._lock:
+            board = self._boards.get(category, Board())
+            rank = board.rank(player)
+            if rank is None:
+                return None
+            return board.best_scores[player], rank
+
+    def flush(self):
+        """ Write the queued scores in one transaction. """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        try:
+            db.session.execute(Score.__table__.insert(), pending)
+            db.session.commit()
+            return
+        except OperationalError:
+            db.session.rollback()
+            # the database is unreachable: keep the scores for next time
+            with self._lock:
+                self._pending[:0] = pending
+            raise
+        except Exception:
+            db.session.rollback()
+
+        for row in pending:
+            try:
+                db.session.execute(Score.__table__.insert(), [row])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                current_app.logger.warning(
+                    'Dropped a score the database rejected: %r', row)
+
+    def _start_worker(self):
+        if self._worker is not None or self.app is None:
+            return
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._worker = threading.Thread(
+                target=self._run, name='score-writer', daemon=True)
+            self._worker.start()
+        atexit.register(self._flush_in_app_context)
+
+    def _flush_in_app_context(self):
+        with self.app.app_context():
+            try:
+                self.flush()
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while True:
+            self._wake.wait(SCORE_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self._flush_in_app_context()
+            except Exception:
+                self.app.logger.exception('Failed to write scores')
+
+
+leaderboard = Leaderboard()
+
+
+def validate_score(payload):
+    """ Check a score submission and return (player, score, category).
+
+        Raises ValueError describing the first problem found.
+    """
+    player = payload.get('player')
+    if not isinstance(player, str) or not player.strip() or \
+            len(player) > MAX_PLAYER_LENGTH:
+        raise ValueError('player must be a name of at most {} characters'
+                         .format(MAX_PLAYER_LENGTH))
+
+    score = payload.get('score')
+    if not isinstance(score, int) or isinstance(score, bool) or score < 0:
+        raise ValueError('score must be a non-negative integer')
+
+    # category 0, like the "ALL" quiz, only counts on the overall board
+    category = payload.get('category') or None
+    if category is not None:
+        category = int(category)
+
+    return player.strip(), score, category
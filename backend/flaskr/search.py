@@ -0,0 +1,195 @@
+import os
+import re
+import threading
+import time
+
+from flask import current_app
+
+from models import db, Question, on_question_change
+
+from .fragments import QUESTION_COLUMNS
+
+# seconds before the in-process index reloads, picking up other processes'
+# writes
+SEARCH_INDEX_MAX_AGE = int(os.getenv('SEARCH_INDEX_MAX_AGE', 300))
+
+# ----------------------------------------------------------------------------#
+# Search backends
+# ----------------------------------------------------------------------------#
+
+
+def like_pattern(term):
+    """ Build an ILIKE pattern matching `term` literally anywhere. """
+    escaped = re.sub(r'([\\%_])', r'\\\1', term)
+    return '%{}%'.format(escaped)
+
+
+class SqlSearch:
+    """ Search inside the database.
+
+        On Postgres the ILIKE filter is served by the trigram GIN index on
+        questions.question. Matches are ordered by id, so only the
+        requested page is ever loaded.
+    """
+
+    def search(self, term, offset, limit, columns=QUESTION_COLUMNS):
+        """ (rows of the given columns on the page, number of matches) """
+        selection = db.session.query(*columns).filter(
+            Question.question.ilike(like_pattern(term), escape='\\')
+        )
+        total_questions = selection.count()
+
+        rows = selection.order_by(Question.id).offset(
+            offset).limit(limit).all()
+
+        return rows, total_questions
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class InvertedIndexSearch:
+    """ In-process trigram index, for databases without an indexed ILIKE.
+
+        Candidates are the intersection of the posting sets of the term's
+        trigrams and are then checked for the actual substring, so results
+        are the same as with ILIKE. Whole-word matches rank first.
+
+        Other processes' writes are picked up when the index is reloaded,
+        at most SEARCH_INDEX_MAX_AGE seconds after the last load.
+    """
+
+    def __init__(self, max_age=SEARCH_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._texts = None
+        self._postings = {}
+        self._loaded_at = 0
+
+    def rebuild(self):
+        texts = {}
+        postings = {}
+        for question_id, text in db.session.query(
+                Question.id, Question.question):
+            text = text.lower()
+            texts[question_id] = text
+            for trigram in trigrams(text):
+                postings.setdefault(trigram, set()).add(question_id)
+
+        with self._lock:
+            self._texts = texts
+            self._postings = postings
+            self._loaded_at = time.time()
+
+        return texts, postings
+
+    def invalidate(self):
+        with self._lock:
+            self._texts = None
+            self._postings = {}
+
+    def add(self, question_id, text):
+        with self._lock:
+            if self._texts is None:
+                return
+            text = text.lower()
+            self._texts[question_id] = text
+            for trigram in trigrams(text):
+                self._postings.setdefault(trigram, set()).add(question_id)
+
+    def discard(self, question_id):
+        with self._lock:
+            if self._texts is None:
+                return
+            text = self._texts.pop(question_id, None)
+            if text is None:
+                return
+            for trigram in trigrams(text):
+                self._postings.get(trigram, set()).discard(question_id)
+
+    def on_change(self, action, question):
+        if action == 'insert':
+            self.add(question.id, question.question)
+        elif action == 'delete':
+            self.discard(question.id)
+        else:
+            self.invalidate()
+
+    def _ensure_loaded(self):
+        """ The texts and posting sets, reloaded first if they are missing
+            or stale. Read them under self._lock.
+        """
+        with self._lock:
+            texts, postings = self._texts, self._postings
+        if texts is None or time.time() - self._loaded_at > self.max_age:
+            texts, postings = self.rebuild()
+        return texts, postings
+
+    def match(self, term):
+        """ Ids of the questions containing `term`, best ranked first. """
+        all_texts, all_postings = self._ensure_loaded()
+        term = term.lower()
+
+        with self._lock:
+            term_trigrams = trigrams(term)
+            if term_trigrams:
+                postings = sorted(
+                    (all_postings.get(trigram, set())
+                     for trigram in term_trigrams),
+                    key=len
+                )
+                candidates = set.intersection(*postings)
+            else:
+                # terms shorter than a trigram have to scan the texts
+                candidates = all_texts.keys()
+            texts = {
+                question_id: all_texts[question_id]
+                for question_id in candidates
+                if term in all_texts[question_id]
+            }
+
+        word = re.compile(r'\b{}\b'.format(re.escape(term)))
+        return sorted(
+            texts,
+            key=lambda question_id: (
+                word.search(texts[question_id]) is None, question_id
+            )
+        )
+
+    def search(self, term, offset, limit, columns=QUESTION_COLUMNS):
+        """ (rows of the given columns on the page, number of matches) """
+        matched_ids = self.match(term)
+        page_ids = matched_ids[offset:offset + limit]
+
+        rows = db.session.query(*columns).filter(
+            Question.id.in_(page_ids)).all() if page_ids else []
+        positions = {
+            question_id: position
+            for position, question_id in enumerate(page_ids)
+        }
+        rows.sort(key=lambda row: positions[row.id])
+
+        return rows, len(matched_ids)
+
+
+sql_search = SqlSearch()
+inverted_index_search = InvertedIndexSearch()
+on_question_change(inverted_index_search.on_change)
+
+SEARCH_BACKENDS = {
+    'sql': sql_search,
+    'inverted': inverted_index_search
+}
+
+
+def get_search_backend():
+    """ Use the SEARCH_BACKEND config if set, otherwise the database's own
+        indexes on Postgres and the in-process index everywhere else.
+    """
+    name = current_app.config.get('SEARCH_BACKEND')
+    if name is None:
+        name = 'sql' if db.engine.dialect.name == 'postgresql' \
+            else 'inverted'
+
+    return SEARCH_BACKENDS[name]
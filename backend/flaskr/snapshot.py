@@ -0,0 +1,276 @@
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from models import db, Category, Question
+from .fragments import QUESTION_COLUMNS, json_fragment
+from .quiz import sample_unused
+
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', None)
+# how often to look for a newly published snapshot, in seconds
+SNAPSHOT_CHECK_INTERVAL = int(os.getenv('SNAPSHOT_CHECK_INTERVAL', 5))
+
+SNAPSHOT_MAGIC = b'TRIVSNAP'
+SNAPSHOT_FORMAT = 1
+# sections in file order; the header holds an (offset, length) per section
+SECTIONS = (
+    'meta',              # JSON: version, categories, per-category ranges
+    'ids',               # int32, every question id in ascending order
+    'fragment_offsets',  # uint32, start of each question's JSON, plus end
+    'fragments',         # UTF-8 JSON of each question, as json_fragment
+    'search_offsets',    # uint32, start of each lowercased question, plus end
+    'search_text',       # UTF-8 lowercased questions, newline separated
+    'category_ids'       # int32, question ids grouped by category
+)
+HEADER = struct.Struct('<8sI4x' + 'QQ' * len(SECTIONS))
+ALIGNMENT = 8
+
+# ----------------------------------------------------------------------------#
+# Writing snapshots
+# ----------------------------------------------------------------------------#
+
+
+def build_sections():
+    """ Read the questions and categories tables into snapshot sections. """
+    ids = array('i')
+    fragment_offsets = array('I', [0])
+    fragments = bytearray()
+    search_offsets = array('I', [0])
+    search_text = bytearray()
+    by_category = {}
+
+    rows = db.session.query(*QUESTION_COLUMNS).order_by(
+        Question.id).yield_per(10000)
+    for row in rows:
+        ids.append(row.id)
+        fragments += json_fragment(row._asdict()).encode('utf-8')
+        fragment_offsets.append(len(fragments))
+        search_text += ' '.join(
+            row.question.lower().split()).encode('utf-8') + b'\n'
+        search_offsets.append(len(search_text))
+        by_category.setdefault(row.category, array('i')).append(row.id)
+
+    category_ids = array('i')
+    categories = []
+    for category in Category.query.order_by(Category.id):
+        questions = by_category.get(category.id, array('i'))
+        categories.append(
+            [category.id, category.type, len(category_ids), len(questions)])
+        category_ids.extend(questions)
+
+    sections = {
+        'ids': ids.tobytes(),
+        'fragment_offsets': fragment_offsets.tobytes(),
+        'fragments': bytes(fragments),
+        'search_offsets': search_offsets.tobytes(),
+        'search_text': bytes(search_text),
+        'category_ids': category_ids.tobytes()
+    }
+    digest = hashlib.sha1()
+    for name in SECTIONS[1:]:
+        digest.update(sections[name])
+    sections['meta'] = json.dumps({
+        'version': digest.hexdigest(),
+        'created_at': int(time.time()),
+        'byteorder': sys.byteorder,
+        'categories': categories
+    }).encode('utf-8')
+
+    return sections
+
+
+def write_snapshot(path):
+    """ Compile the question bank into a snapshot file at `path`.
+
+        The file is written next to its destination and renamed into place,
+        so serving workers never map a half-written snapshot. Returns the
+        number of questions written.
+    """
+    sections = build_sections()
+
+    table = []
+    offset = HEADER.size
+    for name in SECTIONS:
+        offset += -offset % ALIGNMENT
+        table += [offset, len(sections[name])]
+        offset += len(sections[name])
+
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(
+            HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, *table))
+        for index, name in enumerate(SECTIONS):
+            snapshot_file.write(
+                b'\0' * (table[2 * index] - snapshot_file.tell()))
+            snapshot_file.write(sections[name])
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temporary_path, path)
+
+    return len(sections['ids']) // 4
+
+# ----------------------------------------------------------------------------#
+# Reading snapshots
+# ----------------------------------------------------------------------------#
+
+
+class Snapshot:
+    """ A read-only, memory-mapped question bank.
+
+        Nothing is copied out of the mapping up front: id arrays are
+        memoryviews over the file and question JSON is sliced from it on
+        demand, so prefork workers mapping the same file share its pages.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self._map = mmap.mmap(
+                snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        fields = HEADER.unpack_from(self._map)
+        if fields[0] != SNAPSHOT_MAGIC or fields[1] != SNAPSHOT_FORMAT:
+            raise ValueError('{} is not a question snapshot'.format(path))
+        buffer = memoryview(self._map)
+        self._offsets = dict(zip(SECTIONS, fields[2::2]))
+        self._sections = {
+            name: buffer[offset:offset + length]
+            for name, offset, length in zip(
+                SECTIONS, fields[2::2], fields[3::2])
+        }
+
+        meta = json.loads(bytes(self._sections['meta']).decode('utf-8'))
+        if meta['byteorder'] != sys.byteorder:
+            raise ValueError('{} was written on a {}-endian machine'.format(
+                path, meta['byteorder']))
+        self.version = meta['version']
+        self.created_at = meta['created_at']
+
+        self.ids = self._sections['ids'].cast('i')
+        self._fragment_offsets = self._sections['fragment_offsets'].cast('I')
+        self._search_offsets = self._sections['search_offsets'].cast('I')
+        category_ids = self._sections['category_ids'].cast('i')
+        self._categories = [
+            (category_id, category_type)
+            for category_id, category_type, _, _ in meta['categories']
+        ]
+        self._category_ids = {
+            category_id: category_ids[start:start + count]
+            for category_id, _, start, count in meta['categories']
+        }
+
+    def categories(self):
+        """ List of (id, type) pairs, ordered by id. """
+        return self._categories
+
+    def category_type(self, category_id):
+        for current_id, category_type in self._categories:
+            if current_id == category_id:
+                return category_type
+        return None
+
+    def category_ids(self, category_id=None):
+        """ Ascending ids of a category, or of every question when
+            category_id is falsy.
+        """
+        if not category_id:
+            return self.ids
+        return self._category_ids.get(int(category_id), self.ids[:0])
+
+    def _fragment_at(self, index):
+        start = self._fragment_offsets[index]
+        end = self._fragment_offsets[index + 1]
+        return str(self._sections['fragments'][start:end], 'utf-8')
+
+    def fragments(self, question_ids):
+        """ JSON fragments of the given questions, in order. """
+        fragments = []
+        for question_id in question_ids:
+            index = bisect.bisect_left(self.ids, question_id)
+            if index < len(self.ids) and self.ids[index] == question_id:
+                fragments.append(self._fragment_at(index))
+        return fragments
+
+    def question(self, question_id):
+        """ The question as a dict, or None if it is not in the snapshot. """
+        fragments = self.fragments([question_id])
+        return json.loads(fragments[0]) if fragments else None
+
+    def search(self, search_term, offset, limit):
+        """ Fragments of the questions containing `search_term`, ignoring
+            case, ordered by id, and the total number of matches.
+
+            Scans the lowercased question text in place with mmap's find,
+            jumping to the next question after every hit. A term of only
+            whitespace matches nothing.
+        """
+        term = ' '.join(search_term.lower().split()).encode('utf-8')
+        if not term:
+            return [], 0
+        start = self._offsets['search_text']
+        end = start + len(self._sections['search_text'])
+        matches = []
+        position = self._map.find(term, start, end)
+        while position != -1:
+            index = bisect.bisect_right(
+                self._search_offsets, position - start) - 1
+            matches.append(index)
+            position = self._map.find(
+                term, start + self._search_offsets[index + 1], end)
+
+        return (
+            [self._fragment_at(index)
+             for index in matches[offset:offset + limit]],
+            len(matches)
+        )
+
+    def draw(self, category, excluded=(), rng=random):
+        """ Draw an id not in `excluded` from the given category, or from
+            every question when category is falsy.
+        """
+        return sample_unused(self.category_ids(category), excluded, rng)
+
+
+class SnapshotStore:
+    """ The snapshot currently published at `path`.
+
+        At most every SNAPSHOT_CHECK_INTERVAL seconds the file is stat'ed;
+        when a new snapshot was renamed into place it is mapped and swapped
+        in. Requests still holding the old one keep using it until they
+        finish, after which its mapping is released.
+    """
+
+    def __init__(self, path, check_interval=SNAPSHOT_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._identity = None
+        self._checked_at = 0
+
+    def _load(self):
+        self._checked_at = time.time()
+        try:
+            stat = os.stat(self.path)
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if identity != self._identity:
+                self._snapshot = Snapshot(self.path)
+                self._identity = identity
+        except (OSError, ValueError):
+            # keep serving the last good snapshot through a bad publish
+            if self._snapshot is None:
+                raise
+
+    def current(self):
+        if self._snapshot is None or \
+                time.time() - self._checked_at > self.check_interval:
+            with self._lock:
+                self._load()
+        return self._snapshot
@@ -0,0 +1,331 @@
+import csv
+import io
+import json
+
+from models import db, Question, notify_question_change
+
+from .cache import category_cache
+from .duplicates import IMPORT_DUPLICATE_WINDOW, DuplicateCheck
+
+IMPORT_BATCH_SIZE = 1000
+# largest list accepted by the batch create and delete endpoints
+MAX_BATCH_SIZE = 5000
+EXPORT_BATCH_SIZE = 1000
+# keep the import report bounded too
+MAX_REPORTED_ERRORS = 100
+QUESTION_COLUMNS = ('question', 'answer', 'category', 'difficulty')
+
+# ----------------------------------------------------------------------------#
+# Validation
+# ----------------------------------------------------------------------------#
+
+
+def validate_question(payload):
+    """ Check a question payload and return its column values.
+
+        Raises ValueError describing the first problem found.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError('expected an object')
+
+    for field in ('question', 'answer'):
+        value = payload.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError('{} is required'.format(field))
+
+    try:
+        category = int(payload['category'])
+        difficulty = int(payload['difficulty'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('category and difficulty must be integers')
+
+    if not 1 <= difficulty <= 5:
+        raise ValueError('difficulty must be between 1 and 5')
+
+    return {
+        'question': payload['question'],
+        'answer': payload['answer'],
+        'category': category,
+        'difficulty': difficulty
+    }
+
+# ----------------------------------------------------------------------------#
+# Import
+# ----------------------------------------------------------------------------#
+
+
+def iter_ndjson(lines):
+    """ Yield (line number, payload or error) for each non-blank line. """
+    for line_number, line in enumerate(lines, 1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+        except UnicodeDecodeError as error:
+            yield line_number, ValueError('invalid UTF-8: {}'.format(error))
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as error:
+            yield line_number, ValueError('invalid JSON: {}'.format(error))
+
+
+def iter_csv(lines):
+    """ Yield (line number, payload or error) for each CSV record; the
+        first line holds the column names.
+    """
+    # invalid bytes become lone surrogates, which can't be a delimiter,
+    # quote or newline, so the records around them still parse
+    lines = (
+        line.decode('utf-8', 'surrogateescape')
+        if isinstance(line, bytes) else line
+        for line in lines
+    )
+    reader = csv.DictReader(lines)
+    for payload in reader:
+        try:
+            for value in payload.values():
+                if isinstance(value, str):
+                    value.encode('utf-8')
+        except UnicodeEncodeError:
+            yield reader.line_num, ValueError('invalid UTF-8')
+            continue
+        yield reader.line_num, payload
+
+
+def copy_rows(rows):
+    """ Load rows with COPY on Postgres, a multi-row INSERT elsewhere. """
+    if db.engine.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row[column] for column in QUESTION_COLUMNS])
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            'COPY questions ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                ', '.join(QUESTION_COLUMNS)),
+            buffer
+        )
+    else:
+        db.session.execute(Question.__table__.insert(), rows)
+
+
+class ImportReport:
+    """ Running totals and per-row errors of an import. """
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'message': message})
+
+    def format(self):
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors
+        }
+
+
+def write_batch(batch, report):
+    """ Write a batch in one transaction. If the database rejects it,
+        retry the rows one by one so only the bad rows are reported.
+    """
+    try:
+        copy_rows([row for _, row in batch])
+        db.session.commit()
+        report.imported += len(batch)
+        return
+    except Exception:
+        db.session.rollback()
+
+    for line_number, row in batch:
+        try:
+            db.session.execute(Question.__table__.insert(), [row])
+            db.session.commit()
+            report.imported += 1
+        except Exception as error:
+            db.session.rollback()
+            report.error(line_number, str(error.__cause__ or error))
+
+
+def import_questions(records, batch_size=IMPORT_BATCH_SIZE,
+                     check_duplicates=True):
+    """ Validate and insert (line number, payload) records in batches.
+
+        Only one batch is held in memory at a time, so any file size can
+        be imported; lines are checked for duplicates among the last
+        IMPORT_DUPLICATE_WINDOW lines only. Returns an ImportReport.
+    """
+    report = ImportReport()
+    batch = []
+    duplicates = None
+    if check_duplicates:
+        duplicates = DuplicateCheck(
+            label='line', window=IMPORT_DUPLICATE_WINDOW)
+
+    try:
+        for line_number, payload in records:
+            if isinstance(payload, Exception):
+                report.error(line_number, str(payload))
+                continue
+            try:
+                row = validate_question(payload)
+                if category_cache.get(row['category']) is None:
+                    raise ValueError('category does not exist')
+                if duplicates is not None:
+                    duplicates.check(line_number, row['question'])
+            except ValueError as error:
+                report.error(line_number, str(error))
+                continue
+            batch.append((line_number, row))
+
+            if len(batch) >= batch_size:
+                write_batch(batch, report)
+                batch = []
+
+        if batch:
+            write_batch(batch, report)
+    finally:
+        # the new rows bypassed Question.insert()
+        notify_question_change('reset')
+
+    return report
+
+# ----------------------------------------------------------------------------#
+# Batch create and delete
+# ----------------------------------------------------------------------------#
+
+
+def detached_question(row):
+    """ Question object built from column values, used to notify the
+        question listeners without loading the row again.
+    """
+    question = Question(
+        question=row['question'],
+        answer=row['answer'],
+        category=row['category'],
+        difficulty=row['difficulty']
+    )
+    question.id = row['id']
+
+    return question
+
+
+def create_questions(payloads, check_duplicates=True):
+    """ Validate the payloads and insert the valid ones in one transaction,
+        as a single INSERT ... RETURNING on Postgres.
+
+        Returns a result per payload, in order.
+    """
+    results = []
+    rows = []
+    duplicates = DuplicateCheck() if check_duplicates else None
+    for index, payload in enumerate(payloads):
+        try:
+            row = validate_question(payload)
+            if category_cache.get(row['category']) is None:
+                raise ValueError('category does not exist')
+            if duplicates is not None:
+                duplicates.check(index, row['question'])
+        except ValueError as error:
+            results.append({
+                'index': index, 'success': False, 'error': str(error)
+            })
+            continue
+        results.append({'index': index, 'success': True})
+        rows.append(row)
+
+    if not rows:
+        return results
+
+    if db.engine.dialect.name == 'postgresql':
+        inserted = db.session.execute(
+            Question.__table__.insert().values(rows).returning(
+                Question.__table__.c.id)
+        )
+        question_ids = [inserted_row[0] for inserted_row in inserted]
+    else:
+        new_questions = [Question(**row) for row in rows]
+        db.session.add_all(new_questions)
+        db.session.flush()
+        question_ids = [question.id for question in new_questions]
+    db.session.commit()
+
+    created = iter(zip(question_ids, rows))
+    for result in results:
+        if result['success']:
+            question_id, row = next(created)
+            result['id'] = question_id
+            notify_question_change(
+                'insert', detached_question(dict(row, id=question_id)))
+
+    return results
+
+
+def delete_questions(question_ids):
+    """ Delete the given questions with a single DELETE statement.
+
+        Returns a result per id, in order.
+    """
+    rows = db.session.query(
+        Question.id, Question.question, Question.answer,
+        Question.category, Question.difficulty
+    ).filter(Question.id.in_(question_ids)).all()
+    found = {row.id: row for row in rows}
+
+    if found:
+        Question.query.filter(Question.id.in_(list(found))).delete(
+            synchronize_session=False)
+        db.session.commit()
+
+    results = []
+    reported = set()
+    for question_id in question_ids:
+        if question_id in reported:
+            results.append({
+                'id': question_id, 'success': False, 'error': 'duplicate id'
+            })
+            continue
+        reported.add(question_id)
+        row = found.get(question_id)
+        if row is None:
+            results.append({
+                'id': question_id, 'success': False, 'error': 'not found'
+            })
+            continue
+        results.append({'id': question_id, 'success': True})
+        notify_question_change('delete', detached_question(row._asdict()))
+
+    return results
+
+# ----------------------------------------------------------------------------#
+# Export
+# ----------------------------------------------------------------------------#
+
+
+def export_questions(category=None, difficulty=None,
+                     batch_size=EXPORT_BATCH_SIZE):
+    """ Yield the questions as NDJSON lines, ordered by id.
+
+        Rows are read through a server-side cursor in batches, so memory
+        use does not grow with the size of the table.
+    """
+    selection = Question.query.order_by(Question.id)
+    if category is not None:
+        selection = selection.filter_by(category=category)
+    if difficulty is not None:
+        selection = selection.filter_by(difficulty=difficulty)
+
+    selection = selection.execution_options(
+        stream_results=True
+    ).yield_per(batch_size)
+
+    for question in selection:
+        yield json.dumps(question.format()) + '\n'
@@ -0,0 +1,283 @@
+import atexit
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+
+from models import db, primary_reads, QuestionTicket
+from .transfer import create_questions
+
+# accept new questions with 202 and write them in the background
+ASYNC_QUESTION_WRITES = os.getenv('ASYNC_QUESTION_WRITES', '0') == '1'
+QUESTION_QUEUE_SIZE = int(os.getenv('QUESTION_QUEUE_SIZE', 10000))
+QUESTION_FLUSH_BATCH = int(os.getenv('QUESTION_FLUSH_BATCH', 500))
+QUESTION_FLUSH_INTERVAL = float(os.getenv('QUESTION_FLUSH_INTERVAL', 1))
+# writes of a question failing for want of a database before it is given up
+QUESTION_WRITE_ATTEMPTS = int(os.getenv('QUESTION_WRITE_ATTEMPTS', 3))
+# statuses of written tickets kept in memory for lookups
+TICKET_HISTORY = int(os.getenv('TICKET_HISTORY', 100000))
+# seconds a ticket no worker has a status for yet is reported pending:
+# another worker may still be writing it
+TICKET_PENDING_SECONDS = int(os.getenv('TICKET_PENDING_SECONDS', 60))
+# seconds ticket statuses are kept in the question_tickets table
+TICKET_MAX_AGE = int(os.getenv('TICKET_MAX_AGE', 7 * 24 * 3600))
+
+
+def new_ticket():
+    """ Random ticket starting with its issue time in milliseconds. """
+    return '{:x}-{}'.format(int(time.time() * 1000), uuid.uuid4().hex)
+
+
+def ticket_issued_at(ticket):
+    """ Issue time of a ticket in seconds, or None if it has none. """
+    try:
+        return int(ticket.split('-', 1)[0], 16) / 1000
+    except ValueError:
+        return None
+
+# ----------------------------------------------------------------------------#
+# Write-behind queue of new questions
+# ----------------------------------------------------------------------------#
+
+
+class QuestionWriteQueue:
+    """ Bounded queue of validated questions, written in batches.
+
+        submit() only appends to the queue and hands out a ticket; a
+        background thread inserts the queue through create_questions(),
+        every QUESTION_FLUSH_INTERVAL seconds or as soon as
+        QUESTION_FLUSH_BATCH questions are waiting, and the queue is
+        drained once more when the process exits. When QUESTION_QUEUE_SIZE
+        questions are already waiting, submit() raises queue.Full.
+
+        When the database rejects a batch, its questions are written one
+        by one, and the ones it rejects are marked failed. A question
+        whose write fails because the database is unreachable is queued
+        again, up to QUESTION_WRITE_ATTEMPTS times.
+
+        The outcome of every ticket is stored in the question_tickets
+        table after each batch, so any worker, also after a restart, can
+        report it.
+    """
+
+    def __init__(self, max_size=QUESTION_QUEUE_SIZE):
+        self.max_size = max_size
+        self.app = None
+        self._lock = threading.Lock()
+        # held for a whole batch, so the exit flush waits for the worker
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._tickets = OrderedDict()
+        # outcomes not stored in the question_tickets table yet
+        self._unsaved = []
+        self._wake = threading.Event()
+        self._worker = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def submit(self, row, check_duplicates=True):
+        """ Queue a validated question and return its ticket. """
+        ticket = new_ticket()
+
+        with self._lock:
+            if len(self._pending) >= self.max_size:
+                raise queue.Full()
+            self._pending.append((ticket, row, check_duplicates, 0))
+            self._remember(ticket, {'status': 'pending'})
+            if len(self._pending) >= QUESTION_FLUSH_BATCH:
+                self._wake.set()
+        self._start_worker()
+
+        return ticket
+
+    def _remember(self, ticket, status):
+        if status['status'] != 'pending':
+            self._unsaved.append((ticket, status))
+        self._tickets[ticket] = status
+        self._tickets.move_to_end(ticket)
+        while len(self._tickets) > TICKET_HISTORY:
+            self._tickets.popitem(last=False)
+
+    def status(self, ticket):
+        """ {'status': 'pending' | 'created' | 'failed', ...} of a ticket,
+            or None if it is unknown.
+        """
+        with self._lock:
+            status = self._tickets.get(ticket)
+        if status is not None:
+            return status
+
+        with primary_reads():
+            row = QuestionTicket.query.get(ticket)
+        if row is not None:
+            return row.format()
+
+        # queued by another worker, which hasn't written it yet
+        issued_at = ticket_issued_at(ticket)
+        if issued_at is not None and \
+                abs(time.time() - issued_at) < TICKET_PENDING_SECONDS:
+            return {'status': 'pending'}
+
+        return None
+
+    def size(self):
+        return len(self._pending)
+
+    def flush(self):
+        """ Write one batch of queued questions, in one transaction per
+            duplicate-check setting. Returns the number of questions taken
+            off the queue and not queued again.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending[:QUESTION_FLUSH_BATCH]
+                del self._pending[:QUESTION_FLUSH_BATCH]
+            if not batch:
+                return 0
+
+            # questions queued since the index was checked may duplicate
+            # each other, so checked ones are checked again
+            groups = [
+                [item for item in batch if item[2]],
+                [item for item in batch if not item[2]]
+            ]
+            retried = 0
+            for group in groups:
+                if not group:
+                    continue
+                try:
+                    results = create_questions(
+                        [item[1] for item in group],
+                        check_duplicates=group[0][2])
+                except Exception:
+                    db.session.rollback()
+                    retried += self._write_one_by_one(group)
+                    continue
+                self._record(group, results)
+            self._save_outcomes()
+
+            return len(batch) - retried
+
+    def _save_outcomes(self):
+        """ Store the outcomes decided since the last save, and forget the
+            ones older than TICKET_MAX_AGE.
+        """
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, []
+        if not unsaved:
+            return
+
+        now = int(time.time())
+        try:
+            db.session.execute(QuestionTicket.__table__.insert(), [{
+                'ticket': ticket,
+                'status': status['status'],
+                'question_id': status.get('id'),
+                'error': status.get('error'),
+                'created_at': now
+            } for ticket, status in unsaved])
+            QuestionTicket.query.filter(
+                QuestionTicket.created_at < now - TICKET_MAX_AGE
+            ).delete(synchronize_session=False)
+            db.session.commit()
+        except OperationalError:
+            db.session.rollback()
+            # the database is unreachable: save them with the next batch
+            with self._lock:
+                self._unsaved[:0] = unsaved
+        except Exception:
+            db.session.rollback()
+            current_app.logger.warning(
+                'Dropped %d ticket outcomes the database rejected',
+                len(unsaved), exc_info=True)
+
+    def _write_one_by_one(self, group):
+        """ Write the questions of a rejected batch in their own
+            transactions, so only the bad ones fail. Returns the number of
+            questions queued again.
+        """
+        retry = []
+        for item in group:
+            ticket, row, check_duplicates, attempts = item
+            try:
+                results = create_questions(
+                    [row], check_duplicates=check_duplicates)
+            except OperationalError as error:
+                db.session.rollback()
+                if attempts + 1 < QUESTION_WRITE_ATTEMPTS:
+                    retry.append(
+                        (ticket, row, check_duplicates, attempts + 1))
+                else:
+                    self._fail(ticket, error)
+                continue
+            except Exception as error:
+                db.session.rollback()
+                self._fail(ticket, error)
+                continue
+            self._record([item], results)
+
+        if retry:
+            with self._lock:
+                self._pending[:0] = retry
+
+        return len(retry)
+
+    def _fail(self, ticket, error):
+        with self._lock:
+            self._remember(ticket, {
+                'status': 'failed',
+                'error': str(getattr(error, 'orig', None) or error)
+            })
+
+    def _record(self, group, results):
+        with self._lock:
+            for (ticket, _, _, _), result in zip(group, results):
+                if result['success']:
+                    self._remember(
+                        ticket, {'status': 'created', 'id': result['id']})
+                else:
+                    self._remember(
+                        ticket, {'status': 'failed', 'error': result['error']})
+
+    def drain(self):
+        """ Write everything queued so far, except the questions queued
+            again after the database was unreachable.
+        """
+        while self.flush():
+            pass
+
+    def _start_worker(self):
+        if self._worker is not None or self.app is None:
+            return
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._worker = threading.Thread(
+                target=self._run, name='question-writer', daemon=True)
+            self._worker.start()
+        atexit.register(self._drain_in_app_context)
+
+    def _drain_in_app_context(self):
+        with self.app.app_context():
+            try:
+                self.drain()
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while True:
+            self._wake.wait(QUESTION_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self._drain_in_app_context()
+            except Exception:
+                self.app.logger.exception('Failed to write questions')
+
+
+question_writes = QuestionWriteQueue()
@@ -0,0 +1,43 @@
+"""Search indexes on questions.question
+
+Revision ID: 3f2a9c1d5e7b
+Revises: cc7d06b2bc63
+Create Date: 2026-10-18 10:12:41.218305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d5e7b'
+down_revision = 'cc7d06b2bc63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # other databases use the in-process index in flaskr/search.py
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # serves ILIKE '%term%' filters
+    op.create_index(
+        'ix_questions_question_trgm', 'questions', ['question'],
+        postgresql_using='gin',
+        postgresql_ops={'question': 'gin_trgm_ops'}
+    )
+    # serves full-text matching and ranking
+    op.execute(
+        "CREATE INDEX ix_questions_question_tsv ON questions "
+        "USING gin (to_tsvector('english', question))"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_questions_question_tsv', table_name='questions')
+    op.drop_index('ix_questions_question_trgm', table_name='questions')
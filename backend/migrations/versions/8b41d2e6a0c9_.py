@@ -0,0 +1,52 @@
+"""Integer category foreign key and covering indexes on questions
+
+Revision ID: 8b41d2e6a0c9
+Revises: 3f2a9c1d5e7b
+Create Date: 2026-10-18 14:37:05.561902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41d2e6a0c9'
+down_revision = '3f2a9c1d5e7b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # batch mode rebuilds the table on SQLite and is a plain ALTER elsewhere;
+    # existing '1', '2', ... strings are converted in place
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.alter_column(
+            'category',
+            existing_type=sa.String(),
+            type_=sa.Integer(),
+            existing_nullable=True,
+            postgresql_using='category::integer'
+        )
+        batch_op.create_foreign_key(
+            'fk_questions_category_categories',
+            'categories', ['category'], ['id']
+        )
+        batch_op.create_index(
+            'ix_questions_category_id', ['category', 'id'])
+        batch_op.create_index(
+            'ix_questions_category_difficulty', ['category', 'difficulty'])
+
+
+def downgrade():
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_index('ix_questions_category_difficulty')
+        batch_op.drop_index('ix_questions_category_id')
+        batch_op.drop_constraint(
+            'fk_questions_category_categories', type_='foreignkey')
+        batch_op.alter_column(
+            'category',
+            existing_type=sa.Integer(),
+            type_=sa.String(),
+            existing_nullable=True,
+            postgresql_using='category::varchar'
+        )
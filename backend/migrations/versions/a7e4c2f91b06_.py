@@ -0,0 +1,35 @@
+"""Drop the unused full-text index on questions.question
+
+Revision ID: a7e4c2f91b06
+Revises: d5c07e3b9f14
+Create Date: 2026-10-18 21:44:12.508317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e4c2f91b06'
+down_revision = 'd5c07e3b9f14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    # searches filter with ILIKE, which the trigram index serves, and
+    # ts_rank only ranks the matched rows, so this index was never read
+    op.execute('DROP INDEX IF EXISTS ix_questions_question_tsv')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute(
+        "CREATE INDEX ix_questions_question_tsv ON questions "
+        "USING gin (to_tsvector('english', question))"
+    )
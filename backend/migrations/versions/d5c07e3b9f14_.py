@@ -0,0 +1,35 @@
+"""Scores table for the leaderboard
+
+Revision ID: d5c07e3b9f14
+Revises: 8b41d2e6a0c9
+Create Date: 2026-10-18 19:03:26.740158
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5c07e3b9f14'
+down_revision = '8b41d2e6a0c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('scores',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('player', sa.String(), nullable=False),
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.Column('category', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['category'], ['categories.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_scores_category_player', 'scores', ['category', 'player'])
+
+
+def downgrade():
+    op.drop_index('ix_scores_category_player', table_name='scores')
+    op.drop_table('scores')
@@ -0,0 +1,35 @@
+"""Question tickets table for write-behind statuses
+
+Revision ID: e3b9d7a2f415
+Revises: a7e4c2f91b06
+Create Date: 2026-10-18 23:16:52.904137
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b9d7a2f415'
+down_revision = 'a7e4c2f91b06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('question_tickets',
+    sa.Column('ticket', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('question_id', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('ticket')
+    )
+    op.create_index(
+        'ix_question_tickets_created_at', 'question_tickets', ['created_at'])
+
+
+def downgrade():
+    op.drop_index(
+        'ix_question_tickets_created_at', table_name='question_tickets')
+    op.drop_table('question_tickets')
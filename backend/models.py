@@ -1,7 +1,13 @@
+import itertools
 import os
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, String, Integer
-from flask_migrate import Migrate
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import (
+    Column, String, Integer, ForeignKey, Index, create_engine, func, orm
+)
 import json
 
 DB_HOST = os.getenv('DB_HOST', 'localhost:5432')
@@ -12,19 +18,184 @@ DB_PATH = "postgresql://{}:{}@{}/{}".format(
     DB_USER, DB_PASSWORD, DB_HOST, DB_NAME
 )
 
-db = SQLAlchemy()
-migrate = Migrate()
+# connection pool settings of the primary and the replicas
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+# comma separated URLs of read replicas, empty to read from the primary
+DB_REPLICA_PATHS = [
+    path for path in os.getenv('DB_REPLICA_URLS', '').split(',') if path
+]
+REPLICA_CHECK_INTERVAL = int(os.getenv('REPLICA_CHECK_INTERVAL', 30))
+
+# ----------------------------------------------------------------------------#
+# Read replicas
+# ----------------------------------------------------------------------------#
+
+
+class ReadReplicas:
+    """ Engines of the read replicas, handed out round-robin.
+
+        Each replica is checked with a `SELECT 1` when the first one is
+        chosen, and then every REPLICA_CHECK_INTERVAL seconds by a
+        background thread, so requests never wait for a check. While a
+        replica is failing it is skipped, and when every replica is down
+        reads fall back to the primary.
+    """
+
+    def __init__(self, engines, check_interval=REPLICA_CHECK_INTERVAL):
+        self.engines = engines
+        self.check_interval = check_interval
+        self._counter = itertools.count()
+        self._health = {}
+        self._lock = threading.Lock()
+        self._checker = None
+
+    def check(self):
+        """ Check every replica now. """
+        for engine in self.engines:
+            try:
+                with engine.connect() as connection:
+                    connection.execute('SELECT 1')
+                is_healthy = True
+            except Exception:
+                is_healthy = False
+            self._health[engine] = is_healthy
+
+    def start(self):
+        """ Check the replicas, then keep checking them in the background.
+            Called again in a forked process, it starts a new thread.
+        """
+        if not self.engines or \
+                self._checker is not None and self._checker.is_alive():
+            return
+        with self._lock:
+            if self._checker is not None and self._checker.is_alive():
+                return
+            self.check()
+            self._checker = threading.Thread(
+                target=self._run, name='replica-check', daemon=True)
+            self._checker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.check_interval)
+            self.check()
+
+    def healthy(self, engine):
+        return self._health.get(engine, False)
+
+    def choose(self):
+        """ Next healthy replica engine, or None to use the primary. """
+        self.start()
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._counter) % len(self.engines)]
+            if self.healthy(engine):
+                return engine
+        return None
+
+
+def use_read_replica():
+    """ Send the reads of the current request to a read replica. """
+    g.read_replica = True
+
+
+@contextmanager
+def primary_reads():
+    """ Send the reads inside the block to the primary, e.g. to confirm
+        that a row missing on a lagging replica really doesn't exist.
+    """
+    if not has_request_context():
+        yield
+        return
+
+    read_replica = g.get('read_replica', False)
+    g.read_replica = False
+    try:
+        yield
+    finally:
+        g.read_replica = read_replica
+
+
+class RoutingSession(SignallingSession):
+    """ Session that reads from a replica during requests marked with
+        use_read_replica(). Flushes and everything outside those requests
+        go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context() and \
+                g.get('read_replica', False):
+            replicas = self.app.extensions.get('read_replicas')
+            engine = replicas.choose() if replicas else None
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
 
 # ----------------------------------------------------------------------------#
 # setup_db: binds a flask app and a SQLAlchemy service
 # ----------------------------------------------------------------------------#
 
-def setup_db(app, database_path=DB_PATH):
+def engine_options(database_path):
+    """ Connection pool settings, minus the ones SQLite's pools reject. """
+    options = {
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+    if not database_path.startswith('sqlite'):
+        options['pool_size'] = DB_POOL_SIZE
+        options['max_overflow'] = DB_MAX_OVERFLOW
+
+    return options
+
+
+def setup_db(app, database_path=DB_PATH, replica_paths=DB_REPLICA_PATHS,
+             migrations=True):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
+    app.extensions['read_replicas'] = ReadReplicas([
+        create_engine(path, **engine_options(path))
+        for path in replica_paths
+    ])
     db.app = app
     db.init_app(app)
-    migrate.init_app(app, db)
+
+    # Flask-Migrate pulls in Alembic, which lean workers don't need
+    if migrations:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+# ----------------------------------------------------------------------------#
+# Question change listeners
+# ----------------------------------------------------------------------------#
+
+question_listeners = []
+
+
+def on_question_change(listener):
+    """ Register listener(action, question), called after a question
+        change is committed. action is 'insert', 'update' or 'delete', or
+        'reset' (with question None) when many rows changed at once and any
+        derived state should be reloaded.
+    """
+    question_listeners.append(listener)
+    return listener
+
+
+def notify_question_change(action, question=None):
+    for listener in question_listeners:
+        listener(action, question)
 
 # ----------------------------------------------------------------------------#
 # Question model
@@ -32,10 +203,15 @@ def setup_db(app, database_path=DB_PATH):
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # category lists seek on (category, id), quiz draws filter on both
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+    )
     id = Column(Integer, primary_key=True)
     question = Column(String, nullable=False)
     answer = Column(String, nullable=False)
-    category = Column(String, nullable=False)
+    category = Column(Integer, ForeignKey('categories.id'), nullable=False)
     difficulty = Column(Integer, nullable=False)
 
     def __init__(self, question, answer, category, difficulty):
@@ -47,13 +223,16 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_question_change('insert', self)
 
     def update(self):
         db.session.commit()
+        notify_question_change('update', self)
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        notify_question_change('delete', self)
 
     def format(self):
         return {
@@ -64,6 +243,139 @@ class Question(db.Model):
             'difficulty': self.difficulty
         }
 
+# ----------------------------------------------------------------------------#
+# Question counts: per-category and per-difficulty counters kept in step
+# with insert/delete
+# ----------------------------------------------------------------------------#
+
+COUNTS_MAX_AGE = int(os.getenv('COUNTS_MAX_AGE', 300))
+
+
+class QuestionCounts:
+    """ Per-category, per-difficulty and global question counters.
+
+        The counters are loaded with a single GROUP BY query and then kept
+        up to date by Question.insert() and Question.delete(), so reading
+        them never touches the questions table. Besides the per-category
+        totals they keep the category x difficulty matrix. Writes made by
+        other processes are picked up when the counters are rebuilt, which
+        happens every COUNTS_MAX_AGE seconds or on demand via rebuild().
+
+        Each rebuild also records the count and highest id of the
+        questions, overall and per category, as versions of the table
+        that change with any insert or delete, whichever process made it.
+    """
+
+    def __init__(self, max_age=COUNTS_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._counts = None
+        self._matrix = {}
+        self._total = 0
+        self._versions = {}
+        self._version = (0, None)
+        self._loaded_at = 0
+
+    def rebuild(self):
+        """ Recount questions from the database to fix any drift. """
+        rows = db.session.query(
+            Question.category, Question.difficulty,
+            func.count(Question.id), func.max(Question.id)
+        ).group_by(Question.category, Question.difficulty).all()
+        counts = {}
+        matrix = {}
+        last_ids = {}
+        for category, difficulty, count, last_id in rows:
+            counts[category] = counts.get(category, 0) + count
+            matrix.setdefault(category, {})[difficulty] = count
+            last_ids[category] = max(last_ids.get(category, 0), last_id)
+
+        with self._lock:
+            self._counts = counts
+            self._matrix = matrix
+            self._total = sum(counts.values())
+            self._versions = {
+                category: (counts[category], last_ids[category])
+                for category in counts
+            }
+            self._version = (self._total, max(last_ids.values(), default=None))
+            self._loaded_at = time.time()
+
+        return counts
+
+    def invalidate(self):
+        """ Drop the counters; they are rebuilt on the next read. """
+        with self._lock:
+            self._counts = None
+
+    def _ensure_loaded(self):
+        """ The per-category counts, rebuilt first if they are missing or
+            stale. Callers use the returned dict, which a concurrent
+            invalidate() can't take away from them.
+        """
+        counts = self._counts
+        if counts is None or time.time() - self._loaded_at > self.max_age:
+            counts = self.rebuild()
+        return counts
+
+    def total(self):
+        """ Number of questions in the whole bank. """
+        self._ensure_loaded()
+        return self._total
+
+    def count(self, category):
+        """ Number of questions in the given category. """
+        return self._ensure_loaded().get(int(category), 0)
+
+    def version(self, category=None):
+        """ (count, highest id) of the questions, or of one category's, as
+            of the last rebuild.
+        """
+        self._ensure_loaded()
+        if category is None:
+            return self._version
+        return self._versions.get(int(category), (0, None))
+
+    def matrix(self):
+        """ {category: {difficulty: number of questions}}, without the
+            empty cells.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return {
+                category: dict(difficulties)
+                for category, difficulties in self._matrix.items()
+            }
+
+    def on_change(self, action, question):
+        if action == 'insert':
+            self.increment(question.category, question.difficulty)
+        elif action == 'delete':
+            self.increment(question.category, question.difficulty, -1)
+        else:
+            self.invalidate()
+
+    def increment(self, category, difficulty, amount=1):
+        with self._lock:
+            # not loaded yet: the next rebuild will see this write anyway
+            if self._counts is None:
+                return
+            key = int(category)
+            self._counts[key] = self._counts.get(key, 0) + amount
+            self._total += amount
+
+            cells = self._matrix.setdefault(key, {})
+            difficulty = int(difficulty)
+            cells[difficulty] = cells.get(difficulty, 0) + amount
+            if cells[difficulty] <= 0:
+                del cells[difficulty]
+                if not cells:
+                    del self._matrix[key]
+
+
+question_counts = QuestionCounts()
+on_question_change(question_counts.on_change)
+
 # ----------------------------------------------------------------------------#
 # Category model
 # ----------------------------------------------------------------------------#
@@ -81,3 +393,57 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+# ----------------------------------------------------------------------------#
+# Score model
+# ----------------------------------------------------------------------------#
+
+class Score(db.Model):
+    __tablename__ = 'scores'
+    __table_args__ = (
+        Index('ix_scores_category_player', 'category', 'player'),
+    )
+    id = Column(Integer, primary_key=True)
+    player = Column(String, nullable=False)
+    score = Column(Integer, nullable=False)
+    # null for quizzes over all categories
+    category = Column(Integer, ForeignKey('categories.id'), nullable=True)
+    created_at = Column(Integer, nullable=False)
+
+    def __init__(self, player, score, category=None, created_at=None):
+        self.player = player
+        self.score = score
+        self.category = category
+        self.created_at = created_at or int(time.time())
+
+    def format(self):
+        return {
+            'id': self.id,
+            'player': self.player,
+            'score': self.score,
+            'category': self.category,
+            'created_at': self.created_at
+        }
+
+# ----------------------------------------------------------------------------#
+# Question ticket model
+# ----------------------------------------------------------------------------#
+
+class QuestionTicket(db.Model):
+    """ Outcome of a question written behind its request, so every worker
+        can report it.
+    """
+    __tablename__ = 'question_tickets'
+    __table_args__ = (
+        Index('ix_question_tickets_created_at', 'created_at'),
+    )
+    ticket = Column(String, primary_key=True)
+    status = Column(String, nullable=False)
+    question_id = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(Integer, nullable=False)
+
+    def format(self):
+        if self.status == 'created':
+            return {'status': self.status, 'id': self.question_id}
+        return {'status': self.status, 'error': self.error}
@@ -0,0 +1,170 @@
+import json
+import os
+import tempfile
+import unittest
+
+from flaskr import create_app
+from flaskr.cache import category_cache, response_cache
+from models import setup_db, db, notify_question_change, Question, Category
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+if aiosqlite is not None:
+    from flaskr.asgi import TriviaASGI
+
+
+@unittest.skipUnless(aiosqlite, 'aiosqlite is not installed')
+class AsgiTestCase(unittest.IsolatedAsyncioTestCase):
+    """This class represents the ASGI serving mode test case"""
+
+    def setUp(self):
+        """Seed a SQLite database and create both apps."""
+        path = os.path.join(tempfile.mkdtemp(), 'trivia.db')
+        self.flask_app = create_app({
+            'DUPLICATE_CHECK': False,
+            'SECRET_KEY': 'test-secret'
+        })
+        setup_db(self.flask_app, 'sqlite:///' + path)
+        with self.flask_app.app_context():
+            db.create_all()
+            db.session.add_all(
+                Category(category_type)
+                for category_type in ('Science', 'Art', 'Geography'))
+            db.session.add_all(
+                Question(
+                    'Question {} about the world'.format(index),
+                    'Answer {}'.format(index),
+                    index % 3 + 1,
+                    index % 5 + 1
+                ) for index in range(25))
+            db.session.commit()
+        self.reset_caches()
+
+        self.app = TriviaASGI('sqlite:///' + path, self.flask_app)
+
+    async def asyncTearDown(self):
+        await self.app.shutdown()
+        self.reset_caches()
+
+    def reset_caches(self):
+        """Forget what the in-process caches read from other databases."""
+        notify_question_change('reset')
+        category_cache.invalidate()
+        response_cache.clear()
+        with self.flask_app.app_context():
+            db.session.remove()
+
+    async def request(self, method, path, body=None, headers=()):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query.encode('ascii'),
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+        }
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': data}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.app(scope, receive, send)
+        self.headers = dict(messages[0]['headers'])
+        if messages[0]['status'] == 304:
+            return 304, None
+
+        return messages[0]['status'], json.loads(messages[1]['body'])
+
+    async def test_same_responses_as_flask(self):
+        """ Test the read routes against the Flask app. """
+        client = self.flask_app.test_client()
+
+        for path in ('/categories', '/questions?page=2',
+                     '/categories/2/questions', '/questions?page=100'):
+            status, data = await self.request('GET', path)
+            response = client.get(path)
+
+            self.assertEqual(status, response.status_code)
+            self.assertEqual(data, json.loads(response.data))
+
+    async def test_304_get_questions_not_modified(self):
+        """ Test a conditional request for an unchanged page. """
+        await self.request('GET', '/questions')
+        etag = self.headers[b'etag'].decode('ascii')
+        status, _ = await self.request(
+            'GET', '/questions', headers=[('If-None-Match', etag)])
+
+        self.assertEqual(status, 304)
+
+    async def test_create_question(self):
+        """ Test that a created question is counted and can be drawn. """
+        _, before = await self.request('GET', '/categories/3/questions')
+        status, _ = await self.request('POST', '/questions', {
+            'question': 'Which planet is known as the Red Planet?',
+            'answer': 'Mars',
+            'difficulty': 1,
+            'category': 3
+        })
+        _, data = await self.request('GET', '/categories/3/questions')
+        _, quiz = await self.request('POST', '/quizzes', {
+            'quiz_category': {'id': 3},
+            'previous_questions': [
+                question['id'] for question in before['questions']
+            ]
+        })
+
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            data['total_questions'], before['total_questions'] + 1)
+        self.assertEqual(quiz['question']['answer'], 'Mars')
+
+    async def test_quiz_with_state(self):
+        """ Test playing a category until it runs out of questions. """
+        asked_questions = set()
+        quiz_state = None
+
+        while True:
+            status, data = await self.request('POST', '/quizzes', {
+                'quiz_category': {'id': 1},
+                'quiz_state': quiz_state
+            })
+            self.assertEqual(status, 200)
+            quiz_state = data['quiz_state']
+            if data['question'] is None:
+                break
+            self.assertEqual(data['question']['category'], 1)
+            self.assertNotIn(data['question']['id'], asked_questions)
+            asked_questions.add(data['question']['id'])
+
+        self.assertEqual(len(asked_questions), 9)
+
+    async def test_search_questions(self):
+        """ Test searching questions. """
+        status, data = await self.request(
+            'POST', '/questions', {'searchTerm': 'QUESTION 1'})
+
+        self.assertEqual(status, 200)
+        self.assertEqual(data['totalQuestions'], 11)
+        self.assertEqual(len(data['questions']), 10)
+
+    async def test_failed_quiz(self):
+        """ Test quiz requests without a category. """
+        status, data = await self.request('POST', '/quizzes', {})
+
+        self.assertEqual(status, 422)
+        self.assertFalse(data['success'])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,24 @@
+import gzip
 import os
+import shutil
+import sqlite3
+import tempfile
 import unittest
 import json
+import click
 from flask_sqlalchemy import SQLAlchemy
 
-from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr import create_app, warm_up
+from flaskr.snapshot import write_snapshot
+from flaskr.cache import category_cache, response_cache
+from flaskr.quiz import QuizPools
+from flaskr.scores import leaderboard
+from flaskr.search import inverted_index_search
+from flaskr.writes import new_ticket, question_writes
+from models import (
+    setup_db, db, engine_options, notify_question_change, Question, Category,
+    QuestionCounts, Score, question_counts
+)
 
 
 DB_HOST = os.getenv('DB_HOST', 'localhost:5432')
@@ -21,10 +35,18 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        # questions created by earlier runs stay in the test database
+        self.app = create_app({
+            'DUPLICATE_CHECK': False,
+            'SECRET_KEY': 'test-secret'
+        })
         self.client = self.app.test_client
 
         setup_db(self.app, DB_PATH)
+        # other test files fill the in-process caches from other databases
+        notify_question_change('reset')
+        category_cache.invalidate()
+        response_cache.clear()
 
         # binds the app to the current context
         # with self.app.app_context():
@@ -37,6 +59,274 @@ class TriviaTestCase(unittest.TestCase):
         """Executed after reach test"""
         pass
 
+    def test_get_metrics(self):
+        """ Test request instrumentation when metrics are enabled. """
+        app = create_app({'METRICS_ENABLED': True})
+        setup_db(app, DB_PATH)
+        client = app.test_client()
+
+        questions_response = client.get('/questions')
+        response = client.get('/metrics')
+
+        self.assertIn('Server-Timing', questions_response.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            b'trivia_request_duration_seconds_count{method="GET",'
+            b'route="/questions",status="200"}',
+            response.data)
+
+    def test_lean_startup_with_warm_up(self):
+        """ Test serving from a lean, warmed-up app. """
+        app = create_app({'LEAN_STARTUP': True})
+        setup_db(app, DB_PATH, migrations=False)
+        warm_up(app)
+        response = app.test_client().get('/categories')
+
+        self.assertNotIn('migrate', app.extensions)
+        self.assertEqual(response.status_code, 200)
+
+    def test_lean_startup_keeps_migrations_for_the_cli(self):
+        """ Test that the flask command gets the migration commands. """
+        with click.Context(click.Command('db')):
+            app = create_app({'LEAN_STARTUP': True})
+
+        self.assertIn('migrate', app.extensions)
+
+    def test_serve_from_snapshot(self):
+        """ Test answering reads from a published snapshot. """
+        path = os.path.join(tempfile.mkdtemp(), 'questions.snapshot')
+        with self.app.app_context():
+            write_snapshot(path)
+        app = create_app({'SNAPSHOT_PATH': path})
+        setup_db(app, DB_PATH)
+        client = app.test_client()
+
+        response = client.get('/questions')
+        expected = self.client().get('/questions')
+        quiz_response = client.post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': 1}
+        })
+        data = json.loads(quiz_response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.data), json.loads(expected.data))
+        self.assertEqual(data['question']['category'], 1)
+
+    def test_search_snapshot_for_whitespace(self):
+        """ Test searching a snapshot for a term of only whitespace. """
+        path = os.path.join(tempfile.mkdtemp(), 'questions.snapshot')
+        with self.app.app_context():
+            write_snapshot(path)
+        app = create_app({'SNAPSHOT_PATH': path})
+        setup_db(app, DB_PATH)
+
+        response = app.test_client().post(
+            '/questions', json={'searchTerm': '   '})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['totalQuestions'], 0)
+        self.assertEqual(data['questions'], [])
+
+    def test_create_question_write_behind(self):
+        """ Test queueing a new question and writing it later. """
+        app = create_app({
+            'ASYNC_QUESTION_WRITES': True,
+            'DUPLICATE_CHECK': False
+        })
+        setup_db(app, DB_PATH)
+        client = app.test_client()
+
+        response = client.post('/questions', json={
+            'question': 'Which planet is known as the Red Planet?',
+            'answer': 'Mars',
+            'difficulty': 1,
+            'category': 1
+        })
+        ticket = json.loads(response.data)['ticket']
+        with app.app_context():
+            question_writes.drain()
+        data = json.loads(client.get(response.headers['Location']).data)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(data['ticket'], ticket)
+        self.assertEqual(data['status'], 'created')
+        self.assertIsNotNone(Question.query.get(data['id']))
+
+    def test_ticket_status_known_to_other_workers(self):
+        """ Test reading a ticket status written by another worker. """
+        app = create_app({
+            'ASYNC_QUESTION_WRITES': True,
+            'DUPLICATE_CHECK': False
+        })
+        setup_db(app, DB_PATH)
+        client = app.test_client()
+
+        response = client.post('/questions', json={
+            'question': 'Which planet has the most moons?',
+            'answer': 'Saturn',
+            'difficulty': 2,
+            'category': 1
+        })
+        with app.app_context():
+            question_writes.drain()
+        # what a worker that didn't accept the question knows
+        question_writes._tickets.clear()
+        written = json.loads(client.get(response.headers['Location']).data)
+        queued = json.loads(
+            client.get('/questions/tickets/' + new_ticket()).data)
+        unknown = client.get('/questions/tickets/unknown')
+
+        self.assertEqual(written['status'], 'created')
+        self.assertIsNotNone(Question.query.get(written['id']))
+        self.assertEqual(queued['status'], 'pending')
+        self.assertEqual(unknown.status_code, 404)
+
+    def test_write_behind_fails_rejected_question(self):
+        """ Test that a question the database rejects doesn't hold up the
+            rest of the queue.
+        """
+        app = create_app({
+            'ASYNC_QUESTION_WRITES': True,
+            'DUPLICATE_CHECK': False
+        })
+        setup_db(app, DB_PATH)
+        client = app.test_client()
+
+        tickets = [
+            json.loads(client.post('/questions', json={
+                'question': question,
+                'answer': 'Answer',
+                'difficulty': 1,
+                'category': 1
+            }).data)['ticket']
+            for question in ('Rejected \x00 question?', 'Accepted question?')
+        ]
+        with app.app_context():
+            question_writes.drain()
+        statuses = [
+            json.loads(client.get('/questions/tickets/' + ticket).data)
+            for ticket in tickets
+        ]
+
+        self.assertEqual(statuses[0]['status'], 'failed')
+        self.assertEqual(statuses[1]['status'], 'created')
+        self.assertEqual(question_writes.size(), 0)
+
+    def test_400_get_questions_with_zero_limit(self):
+        """ Test paginating questions with a limit below 1. """
+        for path in ('/questions?limit=0', '/categories/1/questions?limit=-1'):
+            response = self.client().get(path)
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['success'], False)
+
+    def test_get_questions_with_fields(self):
+        """ Test narrowing questions to some of their fields. """
+        response = self.client().get('/questions?fields=question,difficulty')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('categories', data)
+        self.assertEqual(
+            set(data['questions'][0]), {'id', 'question', 'difficulty'})
+
+    def test_400_get_questions_with_unknown_fields(self):
+        """ Test narrowing questions to a field they don't have. """
+        response = self.client().get('/questions?fields=question,secret')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_get_compressed_questions(self):
+        """ Test gzip-compressing a page of questions. """
+        app = create_app({'COMPRESS_MIN_SIZE': 0})
+        setup_db(app, DB_PATH)
+        response = app.test_client().get(
+            '/questions', headers={'Accept-Encoding': 'gzip'})
+        data = json.loads(gzip.decompress(response.data))
+
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(response.headers['ETag'].startswith('W/'))
+        self.assertTrue(data['success'])
+
+    def test_compress_with_highest_quality_coding(self):
+        """ Test that the q-values of Accept-Encoding pick the coding. """
+        app = create_app({'COMPRESS_MIN_SIZE': 0})
+        setup_db(app, DB_PATH)
+        response = app.test_client().get(
+            '/questions', headers={'Accept-Encoding': 'gzip;q=1, br;q=0.1'})
+
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+
+    def test_get_category_stats(self):
+        """ Test question counts per category and difficulty. """
+        response = self.client().get('/categories/stats')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(
+            sum(category['total_questions']
+                for category in data['categories'].values()),
+            data['total_questions'])
+        self.assertEqual(
+            data['categories']['1']['total_questions'],
+            Question.query.filter_by(category=1).count())
+
+    def test_rebuild_category_stats(self):
+        """ Test that a rebuild counts questions added by another process. """
+        before_insert = json.loads(
+            self.client().get('/categories/stats').data)
+        with db.engine.begin() as connection:
+            question_id = connection.execute(
+                Question.__table__.insert().values(
+                    question="Counted after a rebuild?",
+                    answer="Yes",
+                    category=1,
+                    difficulty=1
+                )).inserted_primary_key[0]
+        try:
+            response = self.client().post('/categories/stats/rebuild')
+            data = json.loads(response.data)
+        finally:
+            with db.engine.begin() as connection:
+                connection.execute(Question.__table__.delete().where(
+                    Question.id == question_id))
+            notify_question_change('reset')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            data['categories']['1']['total_questions'],
+            before_insert['categories']['1']['total_questions'] + 1)
+
+    def test_cached_page_sees_other_writers(self):
+        """ Test that a question added by another process shows up once the
+            counters are recounted.
+        """
+        response = self.client().get('/questions?page=2')
+        before_insert = json.loads(response.data)
+        with db.engine.begin() as connection:
+            connection.execute(Question.__table__.insert().values(
+                question="Added by another worker?",
+                answer="Yes",
+                category=1,
+                difficulty=1
+            ))
+        question_counts.rebuild()
+        response = self.client().get(
+            '/questions?page=2',
+            headers={'If-None-Match': response.headers['ETag']})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            data['total_questions'], before_insert['total_questions'] + 1)
+
     def test_get_paginated_categories(self):
         """ Test getting all categories. """
         response = self.client().get('/categories')
@@ -46,6 +336,15 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue('success')
         self.assertTrue(data['categories'])
 
+    def test_304_get_categories_not_modified(self):
+        """ Test a conditional request for unchanged categories. """
+        etag = self.client().get('/categories').headers['ETag']
+        response = self.client().get(
+            '/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
     def test_404_get_categories_beyond_valid_page(self):
         """ Test getting categories with invalid page. """
         response = self.client().get('/categories?page=100')
@@ -74,6 +373,37 @@ class TriviaTestCase(unittest.TestCase):
         self.assertFalse(data['success'])
         self.assertEqual(data['message'], "Not Found")
 
+    def test_get_questions_with_cursor(self):
+        """ Test keyset pagination by following the returned cursor. """
+        first_page = json.loads(self.client().get('/questions?limit=5').data)
+        response = self.client().get(
+            '/questions?limit=5&cursor={}'.format(first_page['next_cursor']))
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertGreater(
+            data['questions'][0]['id'], first_page['questions'][-1]['id'])
+
+    def test_400_get_questions_with_invalid_cursor(self):
+        """ Test getting questions with a malformed cursor. """
+        response = self.client().get('/questions?cursor=invalid')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['message'], "Bad Request")
+
+    def test_get_cache_stats(self):
+        """ Test that repeated page requests are served from the cache. """
+        self.client().get('/questions?page=2')
+        before = json.loads(self.client().get('/cache/stats').data)
+        self.client().get('/questions?page=2')
+        after = json.loads(self.client().get('/cache/stats').data)
+
+        self.assertTrue(after['success'])
+        self.assertEqual(after['hits'], before['hits'] + 1)
+
     def test_get_questions_by_category(self):
         """ Test getting paginated questions based on the given category. """
         response = self.client().get('/categories/1/questions')
@@ -115,6 +445,38 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], "Not Found")
 
+    def test_count_while_counters_are_invalidated(self):
+        """ Test counting when another thread drops the fresh counters. """
+        counts = QuestionCounts()
+        rebuild = counts.rebuild
+
+        def rebuild_then_invalidate():
+            loaded = rebuild()
+            counts.invalidate()
+            return loaded
+
+        counts.rebuild = rebuild_then_invalidate
+
+        self.assertEqual(
+            counts.count(1), Question.query.filter_by(category=1).count())
+
+    def test_draw_while_pools_are_invalidated(self):
+        """ Test drawing when another thread drops the fresh pools once. """
+        pools = QuizPools()
+        rebuild = pools.rebuild
+        rebuilds = []
+
+        def rebuild_then_invalidate():
+            rebuild()
+            if not rebuilds:
+                pools.invalidate()
+            rebuilds.append(True)
+
+        pools.rebuild = rebuild_then_invalidate
+
+        self.assertIsNotNone(pools.draw(1))
+        self.assertEqual(len(rebuilds), 2)
+
     def test_get_next_quiz(self):
         """ Test getting the next quiz. """
         request_json = {
@@ -128,6 +490,155 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertTrue(data['question'])
 
+    def test_get_next_quiz_all_categories(self):
+        """ Test getting the next quiz from every category. """
+        request_json = {
+            'previous_questions': [],
+            'quiz_category': {'type': 'click', 'id': 0}
+        }
+        response = self.client().post('/quizzes', json=request_json)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['question'])
+
+    def test_get_next_adaptive_quiz(self):
+        """ Test that a strong player is aimed at hard questions. """
+        response = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'type': 'click', 'id': 0},
+            'adaptive': True,
+            'num_correct': 8,
+            'num_answered': 8
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['question'])
+        self.assertGreater(data['target_difficulty'], 4)
+
+    def test_get_next_quiz_with_quiz_state(self):
+        """ Test that a quiz state token excludes the asked questions. """
+        quiz_state = None
+        asked_ids = []
+        for _ in range(2):
+            response = self.client().post('/quizzes', json={
+                'quiz_state': quiz_state,
+                'quiz_category': {'id': 4}
+            })
+            data = json.loads(response.data)
+            quiz_state = data['quiz_state']
+            asked_ids.append(data['question']['id'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(quiz_state)
+        self.assertNotEqual(asked_ids[0], asked_ids[1])
+
+    def test_get_next_quiz_with_quiz_state_of_high_ids(self):
+        """ Test that a quiz state token records ids past its bitset. """
+        quiz_state = None
+        for previous_questions in ([2 ** 24 + 5], []):
+            response = self.client().post('/quizzes', json={
+                'quiz_state': quiz_state,
+                'previous_questions': previous_questions,
+                'quiz_category': {'id': 4}
+            })
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            quiz_state = data['quiz_state']
+
+        self.assertTrue(data['success'])
+        self.assertTrue(data['question'])
+
+    def test_quiz_state_disabled_without_secret_key(self):
+        """ Test that no tokens are issued or accepted without a key. """
+        app = create_app({'SECRET_KEY': None})
+        setup_db(app, DB_PATH)
+        client = app.test_client()
+        first = client.post('/quizzes', json={
+            'quiz_state': None,
+            'quiz_category': {'id': 4}
+        })
+        token = json.loads(self.client().post('/quizzes', json={
+            'quiz_state': None,
+            'quiz_category': {'id': 4}
+        }).data)['quiz_state']
+        response = client.post('/quizzes', json={
+            'quiz_state': token,
+            'quiz_category': {'id': 4}
+        })
+
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn('quiz_state', json.loads(first.data))
+        self.assertEqual(response.status_code, 400)
+
+    def test_400_get_next_quiz_with_tampered_quiz_state(self):
+        """ Test getting the next quiz with a forged quiz state. """
+        response = self.client().post('/quizzes', json={
+            'quiz_state': 'eJwDAAAAAAE.forged',
+            'quiz_category': {'id': 4}
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_check_quiz_answer(self):
+        """ Test checking a guess with a typo and without the article. """
+        response = self.client().post(
+            '/quizzes/answer', json={'question_id': 20, 'answer': 'livr'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['correct'])
+        self.assertEqual(data['answer'], 'The Liver')
+
+    def test_check_quiz_answer_with_wrong_number(self):
+        """ Test that typos are not tolerated in numbers. """
+        response = self.client().post(
+            '/quizzes/answer', json={'question_id': 2, 'answer': 'Apollo 12'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(data['correct'])
+
+    def test_check_answer_added_by_another_process(self):
+        """ Test checking a guess for a question the index hasn't seen. """
+        self.client().post(
+            '/quizzes/answer', json={'question_id': 20, 'answer': 'liver'})
+        with db.engine.begin() as connection:
+            question_id = connection.execute(
+                Question.__table__.insert().values(
+                    question="Which organ filters the blood?",
+                    answer="The Kidneys",
+                    category=1,
+                    difficulty=2
+                )).inserted_primary_key[0]
+        try:
+            response = self.client().post(
+                '/quizzes/answer',
+                json={'question_id': question_id, 'answer': 'kidneys'})
+        finally:
+            with db.engine.begin() as connection:
+                connection.execute(Question.__table__.delete().where(
+                    Question.id == question_id))
+            # the row bypassed Question.insert() and Question.delete()
+            notify_question_change('reset')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['correct'])
+
+    def test_404_check_answer_of_inexistent_question(self):
+        """ Test checking a guess for a question that does not exist. """
+        response = self.client().post(
+            '/quizzes/answer', json={'question_id': 1000, 'answer': 'x'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data['success'])
+
     def test_405_not_allowed_next_quiz(self):
         """ Test getting the next quiz without request body. """
         response = self.client().get('/quizzes')
@@ -146,6 +657,69 @@ class TriviaTestCase(unittest.TestCase):
         self.assertFalse(data['success'])
         self.assertEqual(data['message'], "Bad Request")
 
+    def test_write_scores_past_a_rejected_one(self):
+        """ Test that a score the database rejects is dropped alone. """
+        before_submit = Score.query.filter_by(player='next-player').count()
+        for player in ('rejected\x00player', 'next-player'):
+            self.client().post(
+                '/scores', json={'player': player, 'score': 2})
+        with self.app.app_context():
+            leaderboard.flush()
+
+        self.assertEqual(
+            Score.query.filter_by(player='next-player').count(),
+            before_submit + 1)
+
+    def test_submit_score_and_get_leaderboard(self):
+        """ Test submitting a score and finding it on the leaderboard. """
+        response = self.client().post('/scores', json={
+            'player': 'test-player',
+            'score': 5,
+            'category': 1
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['best_score'], 5)
+
+        response = self.client().get('/leaderboard/test-player?category=1')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['rank'], 1)
+
+        response = self.client().get('/leaderboard?category=1')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['leaderboard'][0]['player'], 'test-player')
+
+    def test_400_get_leaderboard_with_invalid_limit(self):
+        """ Test getting the leaderboard with a limit that is no count. """
+        for limit in ('-1', '0', 'abc'):
+            response = self.client().get('/leaderboard?limit=' + limit)
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(data['success'])
+
+    def test_404_get_leaderboard_page_below_one(self):
+        """ Test getting a leaderboard page before the first one. """
+        response = self.client().get('/leaderboard?page=-1')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_400_failed_submit_score(self):
+        """ Test submitting a negative score. """
+        response = self.client().post(
+            '/scores', json={'player': 'test-player', 'score': -1})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
     def test_create_new_question(self):
         """ Test creating a new question. """
         new_question = {
@@ -160,6 +734,92 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    def test_409_create_duplicate_question(self):
+        """ Test rejecting a near duplicate of an existing question. """
+        app = create_app({'DUPLICATE_CHECK': True})
+        setup_db(app, DB_PATH)
+        client = app.test_client()
+
+        client.post('/questions', json={
+            'question': "Who wrote the novel Moby-Dick?",
+            'answer': "Herman Melville",
+            'category': "5",
+            'difficulty': 2,
+            'allow_duplicate': True
+        })
+        response = client.post('/questions', json={
+            'question': "who wrote the novel Moby Dick",
+            'answer': "Melville",
+            'category': "5",
+            'difficulty': 2
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['duplicates'][0]['similarity'], 1.0)
+
+    def test_create_question_updates_total(self):
+        """ Test that creating a question is reflected in the counters. """
+        before_create = json.loads(
+            self.client().get('/categories/1/questions').data)
+        self.client().post('/questions', json={
+            'question': "What is the chemical symbol of gold?",
+            'answer': "Au",
+            'category': "1",
+            'difficulty': 2
+        })
+        after_create = json.loads(
+            self.client().get('/categories/1/questions').data)
+
+        self.assertEqual(
+            after_create['total_questions'],
+            before_create['total_questions'] + 1)
+
+    def test_create_and_delete_question_batch(self):
+        """ Test creating and then deleting questions in batches. """
+        new_questions = [{
+            'question': "Batch question {}".format(index),
+            'answer': "Batch answer",
+            'category': 1,
+            'difficulty': 1
+        } for index in range(3)]
+        new_questions.append({'question': "Missing answer"})
+
+        response = self.client().post(
+            '/questions/batch', json={'questions': new_questions})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['created'], 3)
+        self.assertFalse(data['results'][3]['success'])
+
+        question_ids = [
+            result['id'] for result in data['results'] if result['success']
+        ]
+        response = self.client().delete(
+            '/questions/batch',
+            json={'ids': question_ids + [question_ids[0], 1000]})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['deleted'], 3)
+        self.assertEqual(data['results'][3]['error'], 'duplicate id')
+        self.assertEqual(data['results'][4]['error'], 'not found')
+
+    def test_422_create_question_with_invalid_difficulty(self):
+        """ Test creating a question with a difficulty out of range. """
+        response = self.client().post('/questions', json={
+            'question': "How hard can it be?",
+            'answer': "Very",
+            'category': 1,
+            'difficulty': 99
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(data['success'])
+
     def test_400_failed_creation(self):
         """ Test failing in creating new question with bad request. """
         response = self.client().post('/questions')
@@ -169,6 +829,82 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], "Bad Request")
 
+    def test_import_questions(self):
+        """ Test bulk importing questions, reporting the invalid rows. """
+        lines = [
+            json.dumps({
+                'question': "Which planet is known as the Red Planet?",
+                'answer': "Mars",
+                'category': 1,
+                'difficulty': 1
+            }),
+            json.dumps({'question': "Missing answer", 'category': 1})
+        ]
+        response = self.client().post(
+            '/questions/import',
+            data='\n'.join(lines),
+            content_type='application/x-ndjson'
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(data['errors'][0]['line'], 2)
+
+    def test_import_questions_with_invalid_utf8(self):
+        """ Test that a line of invalid UTF-8 is reported on its own. """
+        lines = [
+            b'question,answer,category,difficulty',
+            b'Which gas do plants absorb?,Carbon dioxide,1,1',
+            b'Caf\xe9 question?,Answer,1,1'
+        ]
+        response = self.client().post(
+            '/questions/import',
+            data=b'\n'.join(lines),
+            content_type='text/csv'
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['errors'][0]['line'], 3)
+
+    def test_import_questions_into_inexistent_category(self):
+        """ Test that imported rows of an unknown category are reported. """
+        line = json.dumps({
+            'question': "Which metal is liquid at room temperature?",
+            'answer': "Mercury",
+            'category': 1000,
+            'difficulty': 2
+        })
+        response = self.client().post(
+            '/questions/import',
+            data=line,
+            content_type='application/x-ndjson'
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['imported'], 0)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(
+            data['errors'][0]['message'], 'category does not exist')
+
+    def test_export_questions_by_category(self):
+        """ Test exporting the questions of a category as NDJSON. """
+        response = self.client().get('/questions/export?category=1')
+        questions = [
+            json.loads(line) for line in response.data.splitlines()
+        ]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertTrue(questions)
+        self.assertTrue(
+            all(str(question['category']) == '1' for question in questions))
+
     def test_search_questions(self):
         """ Test searching for questions. """
         search_item = {
@@ -181,6 +917,61 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertEqual(data['totalQuestions'], 2)
 
+    def test_search_questions_with_fields(self):
+        """ Test searching for only some fields of the questions. """
+        response = self.client().post(
+            '/questions?fields=question', json={'searchTerm': 'world'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['questions'])
+        self.assertTrue(all(
+            set(question) == {'id', 'question'}
+            for question in data['questions']))
+
+    def test_search_questions_paginated(self):
+        """ Test that search results are paginated but fully counted. """
+        response = self.client().post(
+            '/questions?limit=1', json={'searchTerm': 'world'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['questions']), 1)
+        self.assertEqual(data['totalQuestions'], 2)
+
+    def test_in_process_search_sees_other_writers(self):
+        """ Test that the in-process index finds questions another process
+            added once it is reloaded.
+        """
+        self.app.config['SEARCH_BACKEND'] = 'inverted'
+        before = json.loads(self.client().post(
+            '/questions', json={'searchTerm': 'glacier'}).data)
+        with db.engine.begin() as connection:
+            question_id = connection.execute(
+                Question.__table__.insert().values(
+                    question="Which glacier is the longest in the Alps?",
+                    answer="Aletsch",
+                    category=3,
+                    difficulty=4
+                )).inserted_primary_key[0]
+        max_age = inverted_index_search.max_age
+        inverted_index_search.max_age = 0
+        try:
+            response = self.client().post(
+                '/questions', json={'searchTerm': 'glacier'})
+        finally:
+            inverted_index_search.max_age = max_age
+            with db.engine.begin() as connection:
+                connection.execute(Question.__table__.delete().where(
+                    Question.id == question_id))
+            # the row bypassed Question.insert() and Question.delete()
+            notify_question_change('reset')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            data['totalQuestions'], before['totalQuestions'] + 1)
+
     def test_failed_search(self):
         """ Test failing in searching question with inexistent string. """
         response = self.client().post(
@@ -192,6 +983,135 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['totalQuestions'], 0)
 
 
+class ReadReplicaTestCase(unittest.TestCase):
+    """This class represents the read replica routing test case"""
+
+    def setUp(self):
+        """Create a primary and a replica SQLite file with different
+        questions."""
+        self.directory = tempfile.mkdtemp()
+        self.primary_path = os.path.join(self.directory, 'primary.db')
+        replica_path = os.path.join(self.directory, 'replica.db')
+        self.app = self.create_app('sqlite:///' + replica_path)
+
+        for engine, name in ((db.get_engine(self.app), 'Primary'),
+                             (self.app.extensions['read_replicas'].engines[0],
+                              'Replica')):
+            db.metadata.create_all(engine)
+            engine.execute(
+                Category.__table__.insert(), [{'type': 'Science'}])
+            engine.execute(Question.__table__.insert(), [{
+                'question': '{} question {}'.format(name, index),
+                'answer': 'Answer',
+                'category': 1,
+                'difficulty': 1
+            } for index in range(3)])
+
+    def tearDown(self):
+        """Forget what the in-process caches read from these files."""
+        self.reset_caches()
+        shutil.rmtree(self.directory)
+
+    def create_app(self, replica_url):
+        self.reset_caches()
+        app = create_app({'DUPLICATE_CHECK': False, 'SEARCH_BACKEND': 'sql'})
+        setup_db(app, 'sqlite:///' + self.primary_path, [replica_url])
+        return app
+
+    def reset_caches(self):
+        notify_question_change('reset')
+        category_cache.invalidate()
+        response_cache.clear()
+        db.session.remove()
+
+    def test_engine_options(self):
+        """ Test pool sizes are only set where the pool accepts them. """
+        postgres_options = engine_options(DB_PATH)
+        sqlite_options = engine_options('sqlite:///' + self.primary_path)
+
+        self.assertIn('pool_size', postgres_options)
+        self.assertIn('max_overflow', postgres_options)
+        self.assertNotIn('pool_size', sqlite_options)
+        self.assertIn('pool_pre_ping', sqlite_options)
+
+    def test_reads_from_replica(self):
+        """ Test that lists and search read from the replica. """
+        questions = json.loads(self.app.test_client().get('/questions').data)
+        found = json.loads(self.app.test_client().post(
+            '/questions', json={'searchTerm': 'question 1'}).data)
+
+        self.assertEqual(
+            questions['questions'][0]['question'], 'Replica question 0')
+        self.assertEqual(
+            [question['question'] for question in found['questions']],
+            ['Replica question 1'])
+
+    def test_writes_to_primary(self):
+        """ Test that creating a question writes to the primary. """
+        response = self.app.test_client().post('/questions', json={
+            'question': 'Written question',
+            'answer': 'Answer',
+            'category': 1,
+            'difficulty': 1
+        })
+        with sqlite3.connect(self.primary_path) as connection:
+            written = connection.execute(
+                "SELECT count(*) FROM questions "
+                "WHERE question = 'Written question'").fetchone()[0]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(written, 1)
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        """ Test reading from the primary when the replica is down. """
+        app = self.create_app(
+            'sqlite:///' + os.path.join(self.directory, 'missing', 'r.db'))
+        response = app.test_client().get('/questions')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            data['questions'][0]['question'], 'Primary question 0')
+
+    def test_quiz_draws_question_missing_on_replica(self):
+        """ Test drawing a question the replica doesn't have yet. """
+        client = self.app.test_client()
+        client.post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': 1}
+        })
+        client.post('/questions', json={
+            'question': 'Only on the primary',
+            'answer': 'Answer',
+            'category': 1,
+            'difficulty': 1
+        })
+        response = client.post('/quizzes', json={
+            'previous_questions': [1, 2, 3],
+            'quiz_category': {'id': 1}
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['question']['question'], 'Only on the primary')
+
+    def test_check_answer_missing_on_replica(self):
+        """ Test checking the answer of a question the replica lacks. """
+        with sqlite3.connect(self.primary_path) as connection:
+            question_id = connection.execute(
+                "INSERT INTO questions (question, answer, category, "
+                "difficulty) VALUES ('Only on the primary', 'Lag', 1, 1)"
+            ).lastrowid
+        response = self.app.test_client().post('/quizzes/answer', json={
+            'question_id': question_id,
+            'answer': 'lag'
+        })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['correct'])
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
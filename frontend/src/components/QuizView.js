@@ -11,11 +11,13 @@ class QuizView extends Component {
     this.state = {
         quizCategory: null,
         previousQuestions: [], 
+        quizState: null,
         showAnswer: false,
         categories: {},
         numCorrect: 0,
         currentQuestion: {},
         guess: '',
+        lastGuessCorrect: false,
         forceEnd: false
     }
   }
@@ -47,15 +49,24 @@ class QuizView extends Component {
     const previousQuestions = [...this.state.previousQuestions]
     if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
 
+    const request = {
+      quiz_category: this.state.quizCategory,
+      hide_answer: true
+    }
+    // servers with a SECRET_KEY answer the first question with a token of
+    // the asked questions; the others need the ids resent every time
+    if(this.state.quizState || !this.state.currentQuestion.id) {
+      request.quiz_state = this.state.quizState
+    } else {
+      request.previous_questions = previousQuestions
+    }
+
     $.ajax({
       url: '/quizzes', //TODO: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
-      data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
-      }),
+      data: JSON.stringify(request),
       xhrFields: {
         withCredentials: true
       },
@@ -64,6 +75,7 @@ class QuizView extends Component {
         this.setState({
           showAnswer: false,
           previousQuestions: previousQuestions,
+          quizState: result.quiz_state,
           currentQuestion: result.question,
           guess: '',
           forceEnd: result.question ? false : true
@@ -79,11 +91,32 @@ class QuizView extends Component {
 
   submitGuess = (event) => {
     event.preventDefault();
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    let evaluate =  this.evaluateAnswer()
-    this.setState({
-      numCorrect: !evaluate ? this.state.numCorrect : this.state.numCorrect + 1,
-      showAnswer: true,
+    $.ajax({
+      url: '/quizzes/answer', //TODO: update request URL
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        question_id: this.state.currentQuestion.id,
+        answer: this.state.guess
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({
+          numCorrect: !result.correct ? this.state.numCorrect : this.state.numCorrect + 1,
+          currentQuestion: {...this.state.currentQuestion, answer: result.answer},
+          lastGuessCorrect: result.correct,
+          showAnswer: true,
+        })
+        return;
+      },
+      error: (error) => {
+        alert('Unable to check your answer. Please try your request again')
+        return;
+      }
     })
   }
 
@@ -91,10 +124,12 @@ class QuizView extends Component {
     this.setState({
       quizCategory: null,
       previousQuestions: [], 
+      quizState: null,
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
+      lastGuessCorrect: false,
       forceEnd: false
     })
   }
@@ -130,15 +165,8 @@ class QuizView extends Component {
     )
   }
 
-  evaluateAnswer = () => {
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    const answerArray = this.state.currentQuestion.answer.toLowerCase().split(' ');
-    return answerArray.every(el => formatGuess.includes(el));
-  }
-
   renderCorrectAnswer(){
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    let evaluate =  this.evaluateAnswer()
+    let evaluate = this.state.lastGuessCorrect
     return(
       <div className="quiz-play-holder">
         <div className="quiz-question">{this.state.currentQuestion.question}</div>